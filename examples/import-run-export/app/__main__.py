@@ -9,6 +9,7 @@ from hephaestus import (
 )
 from hephaestus.types import File, VolumeFolder, Project
 from app.context import Context
+from app.utils import metadata_up_to_date
 from app.types import Sample
 
 
@@ -121,15 +122,40 @@ class ImportFilesAndGroupBySample(Step):
     def update_file_metadata(self, files):
         """Sets file metadata in bulk for list of files based on file names.
         Setting metadata in bulk instead of per-file reduces API calls.
+        If 'skip_unchanged_metadata' is set in config, files that already
+        have the desired metadata (e.g. during re-runs) are not updated.
         Example filename: TCRBOA7-N-WEX-TEST.read1.fastq"""
 
-        metadata = []
+        skip_unchanged = self.config_.skip_unchanged_metadata
+
+        unchanged_files, files_to_update, metadata = [], [], []
         for file in files:
             sample_id = file.name.split("-WEX")[0]
             paired_end = file.name.split("read")[1].split(".")[0]
-            metadata.append({"sample_id": sample_id, "paired_end": paired_end})
-
-        return SetMetadataBulk(to_files=files, metadata=metadata).updated_files
+            record = {"sample_id": sample_id, "paired_end": paired_end}
+
+            if skip_unchanged and metadata_up_to_date(file, record, keep_old=False):
+                unchanged_files.append(file)
+            else:
+                files_to_update.append(file)
+                metadata.append(record)
+
+        if skip_unchanged:
+            logging.info(
+                f"Metadata already up to date for {len(unchanged_files)} of "
+                f"{len(files)} files, skipped these metadata writes."
+            )
+        if not files_to_update:
+            return unchanged_files
+
+        updated_files = SetMetadataBulk(
+            to_files=files_to_update, metadata=metadata
+        ).updated_files
+
+        # keep input order, e.g. read 1 before read 2, so that task inputs
+        # and thereby re-used tasks do not depend on which files were updated
+        updated_files = {f.id: f for f in updated_files}
+        return [updated_files.get(f.id, f) for f in files]
 
     def group_files_by_sample(self, files):
         """Groups files into list of sample objects for easier downstream
@@ -1,13 +1,12 @@
 import inject
-import os.path
+import json
+import logging
+from types import MappingProxyType
 from freyja.config import Config
 from freyja.graph import Singleton
 from hephaestus import SBApi
-from hephaestus.steps import (
-    FindOrCopyApp,
-    FindOrCopyFilesByName,
-    FindOrCreateProject,
-)
+from hephaestus.steps import FindOrCopyApp, FindOrCreateProject
+from app.staging import ReferenceStaging
 
 
 class Context(metaclass=Singleton):
@@ -28,36 +27,121 @@ class Context(metaclass=Singleton):
         self.refs = {}
 
     def initialize(self, project_name):
+        """Initializes context. Apps and reference files are staged
+        concurrently and published only when all of them have been staged.
+        If 'context_snapshot' is set in config, context is restored from
+        snapshot of previous run if still valid, see load_snapshot()."""
+
+        if self.config.context_snapshot and self.load_snapshot(project_name):
+            logging.info(f"Context restored from snapshot (project {self.project.id})")
+            return self
+
         self.project = FindOrCreateProject(
             billing_group_name=self.get_first_billing_group(), name=project_name
         ).project
 
-        self.stage_apps()
-        self.stage_references()
+        # instantiate all staging steps first so that they execute concurrently
+        app_steps = self.stage_apps()
+        ref_staging = self.stage_references()
+
+        apps = {app_name: step.app for app_name, step in app_steps.items()}
+        refs = ref_staging.resolve()
+
+        self.apps = MappingProxyType(apps)
+        self.refs = MappingProxyType(refs)
+
+        if self.config.context_snapshot:
+            self.store_snapshot(project_name)
 
         return self
 
+    def snapshot_key(self, project_name):
+        """Returns key of context snapshot: canonical JSON of project name and
+        app and reference file configuration, independent of config classes"""
+
+        return json.dumps(
+            {
+                "project": project_name,
+                "apps": self.config.apps.data,
+                "reference_files": self.config.reference_files.data,
+            },
+            sort_keys=True,
+            default=str,
+        )
+
+    def load_snapshot(self, project_name):
+        """Restores project, apps and reference files staged by previous run
+        with same project name and same app and reference file configuration.
+        Instead of staging everything again, the snapshot is verified with one
+        request each: project get, query of apps in project, and bulk get of
+        reference files. Returns True if context was restored, False if there
+        is no snapshot or it is out of date."""
+
+        from app import cache  # imported here, cache depends on context
+
+        snapshot = cache.load("context", self.snapshot_key(project_name))
+        if snapshot is None:
+            return False
+
+        try:
+            project = SBApi().projects.get(id=snapshot["project"])
+            project_apps = {
+                app.id: app for app in SBApi().apps.query(project=project.id).all()
+            }
+            records = SBApi().files.bulk_get(files=list(snapshot["refs"].values()))
+        except Exception as e:
+            logging.warning(f"Context snapshot not accessible: {e}")
+            return False
+
+        apps = {
+            app_name: project_apps.get(app_id)
+            for app_name, app_id in snapshot["apps"].items()
+        }
+        refs = {
+            ref_name: r.resource if r.valid else None
+            for ref_name, r in zip(snapshot["refs"], records)
+        }
+        if any(v is None for v in [*apps.values(), *refs.values()]):
+            logging.info("Context snapshot out of date, staging again")
+            return False
+
+        self.project = project
+        self.apps = MappingProxyType(apps)
+        self.refs = MappingProxyType(refs)
+        return True
+
+    def store_snapshot(self, project_name):
+        "Stores IDs of staged project, apps and reference files"
+
+        from app import cache
+
+        cache.store(
+            "context",
+            self.snapshot_key(project_name),
+            {
+                "project": self.project.id,
+                "apps": {name: app.id for name, app in self.apps.items()},
+                "refs": {name: file.id for name, file in self.refs.items()},
+            },
+        )
+
     def get_first_billing_group(self):
         for bg in SBApi().billing_groups.query().all():
             return bg.name
 
     def stage_apps(self):
-        for app_name, app_id in self.config.apps.data.items():
-            self.apps[app_name] = FindOrCopyApp(
+        "Returns dict with app name -> staging step"
+
+        return {
+            app_name: FindOrCopyApp(
                 f"FindOrCopyApp-{app_name}", app_id=app_id, to_project=self.project
-            ).app
+            )
+            for app_name, app_id in self.config.apps.data.items()
+        }
 
     def stage_references(self):
-        for ref_name, file_path in self.config.reference_files.data.items():
-            self.refs[ref_name] = self.stage_reference_file(ref_name, file_path)
-
-    def stage_reference_file(self, ref_name, file_path):
-        ref_project_id, file_name = os.path.split(file_path)
-        ref_project = SBApi().projects.get(id=ref_project_id)
-
-        return FindOrCopyFilesByName(
-            f"CopyRef-{ref_name}",
-            names=[file_name],
-            from_project=ref_project,
-            to_project=self.project,
-        ).copied_files[0]
+        "Returns ReferenceStaging of reference files in config file, copied to root"
+
+        return ReferenceStaging(
+            self.config.reference_files.data, self.project, to_path=None
+        )
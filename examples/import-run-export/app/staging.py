@@ -0,0 +1,83 @@
+"""
+Staging of reference files into the execution project. Reference files are
+grouped by source project and folder and copied with one bulk copy step per
+group. Source projects are looked up once per process, concurrently, and all
+copy steps are instantiated before any of them is waited for, so that they
+execute concurrently as well.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from hephaestus import SBApi
+from hephaestus.steps import FindOrCopyFilesByName
+
+STAGING_THREADS = 8  # max. number of concurrent source project lookups
+
+source_projects = {}  # project ID -> project, looked up once per process
+
+
+def parse_file_path(file_path):
+    """Splits file path '<user>/<project>/<folder>/.../<file name>' into
+    project ID, folder path (empty if file is in project root) and file name"""
+
+    parts = file_path.strip().split("/")
+    return "/".join(parts[:2]), "/".join(parts[2:-1]), parts[-1]
+
+
+def get_source_projects(project_ids):
+    """Returns dict with project ID -> project. Projects not looked up before
+    are fetched in parallel. Returns number of lookups as second value."""
+
+    missing = sorted(set(project_ids) - set(source_projects))
+    if missing:
+        with ThreadPoolExecutor(max_workers=STAGING_THREADS) as pool:
+            projects = pool.map(lambda id_: SBApi().projects.get(id=id_), missing)
+            source_projects.update(zip(missing, projects))
+    return {id_: source_projects[id_] for id_ in project_ids}, len(missing)
+
+
+class ReferenceStaging:
+    """Copies reference files, given as dict of reference name -> file path,
+    to project. Copying starts on instantiation, resolve() waits for it."""
+
+    def __init__(self, ref_files, to_project, to_path="reference_files"):
+        self.groups = {}  # (project ID, folder path) -> {file name: ref name}
+        for ref_name, file_path in ref_files.items():
+            project, path, name = parse_file_path(file_path)
+            self.groups.setdefault((project, path), {})[name] = ref_name
+
+        projects, self.num_lookups = get_source_projects(
+            {project for project, _ in self.groups}
+        )
+
+        self.copy_steps = {
+            (project, path): FindOrCopyFilesByName(
+                name_=f"CopyFiles-{project}|{path}",
+                names=list(file2ref),
+                from_project=projects[project],
+                from_path=path if path else None,
+                to_project=to_project,
+                to_path=to_path,
+            )
+            for (project, path), file2ref in self.groups.items()
+        }
+
+    def resolve(self):
+        "Waits for all copy steps, returns dict with reference name -> file"
+
+        refs = {}
+        for location, step in self.copy_steps.items():
+            file2ref = self.groups[location]
+            for file in step.copied_files:
+                logging.info(
+                    "Reference staged: %s -> %s" % (file2ref[file.name], file.name)
+                )
+                refs[file2ref[file.name]] = file
+
+        num_calls = self.num_lookups + len(self.copy_steps)
+        logging.info(
+            f"Staged {len(refs)} reference files from {len(self.groups)} locations"
+            f" with {num_calls} staging calls"
+            f" ({num_calls / max(len(refs), 1):.2f} per reference)"
+        )
+        return refs
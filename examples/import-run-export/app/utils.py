@@ -0,0 +1,11 @@
+def metadata_up_to_date(file, metadata, keep_old=True):
+    """Returns true if file already has given metadata, in which case
+    there is no need to update it. Values are compared as strings. With
+    'keep_old', metadata fields not given are ignored, otherwise file
+    must not have any other metadata fields."""
+
+    existing = file.metadata or {}
+    if not keep_old and set(existing) != set(metadata):
+        return False
+
+    return all(str(existing.get(k)) == str(v) for k, v in metadata.items())
@@ -0,0 +1,92 @@
+"""
+Measures memory used per lane by the entity model: the original model with
+attributes in instance dicts (baseline), standalone Lane objects with slots,
+and lanes stored in a LaneTable. File name strings are created and samples
+are built up front and not counted, so numbers reflect the overhead of
+storing lanes.
+Run from inside project root directory:
+
+    python -m benchmarks.bench_entities [--lanes 100000]
+"""
+
+import argparse
+import tracemalloc
+from sampleqc.entities import Cohort, Patient, Sample, Lane, LaneTable
+
+LANES_PER_SAMPLE = 4
+
+
+class DictSample:
+    "Sample of the original entity model, lanes kept in a list"
+
+    def __init__(self, id):
+        self.id = id
+        self.type = None
+        self.source = None
+        self.lanes = []
+        self.patient = None
+
+    def add_lane(self, lane):
+        self.lanes.append(lane)
+        lane.sample = self
+
+
+class DictLane:
+    "Lane of the original entity model, attributes kept in instance dict"
+
+    def __init__(self, read_group=1, fq1=None, fq2=None):
+        self.read_group = int(read_group)
+        self.fq1 = fq1
+        self.fq2 = fq2
+        self.file_name_root = None
+        self.library_name = None
+        self.processing_unit = None
+        self.sample = None
+
+
+def build_samples(num_lanes, lane_table=None):
+    "Builds cohort with one patient per sample, without any lanes yet"
+
+    cohort = Cohort(manifest_file="manifest.tsv")
+    for i in range(0, num_lanes, LANES_PER_SAMPLE):
+        patient = Patient(f"P{i}")
+        cohort.add_patient(patient)
+        patient.add_sample(Sample(f"S{i}", lane_table=lane_table))
+    return list(cohort.samples)
+
+
+def bytes_per_lane(names, samples, lane_class):
+    tracemalloc.start()
+    for i, (fq1, fq2) in enumerate(names):
+        sample = samples[i // LANES_PER_SAMPLE]
+        sample.add_lane(
+            lane_class(read_group=i % LANES_PER_SAMPLE + 1, fq1=fq1, fq2=fq2)
+        )
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return current / len(names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lanes", type=int, default=100000)
+    args = parser.parse_args()
+
+    names = [(f"L{i}_R1.fastq", f"L{i}_R2.fastq") for i in range(args.lanes)]
+    num_samples = -(-args.lanes // LANES_PER_SAMPLE)
+
+    baseline = bytes_per_lane(
+        names, [DictSample(f"S{i}") for i in range(num_samples)], DictLane
+    )
+    lane = bytes_per_lane(names, build_samples(args.lanes), Lane)
+    table = bytes_per_lane(names, build_samples(args.lanes, LaneTable()), Lane)
+
+    print(f"{'model':>12} {'bytes/lane':>11} {'vs. baseline':>13}")
+    results = [("dict (base)", baseline), ("Lane", lane), ("LaneTable", table)]
+    for model, size in results:
+        print(f"{model:>12} {size:>11.0f} {size / baseline:>12.0%}")
+
+
+if __name__ == "__main__":
+    main()
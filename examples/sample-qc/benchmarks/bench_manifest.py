@@ -0,0 +1,73 @@
+"""
+Benchmarks manifest parsing for large plain and gzip-compressed manifests.
+Reports wall time, throughput and peak memory allocated while parsing.
+Run from inside project root directory:
+
+    python -m benchmarks.bench_manifest [--rows 100000 500000]
+"""
+
+import argparse
+import gzip
+import os
+import tempfile
+import time
+import tracemalloc
+from sampleqc.manifest import build_cohort, read_manifest
+
+LANES_PER_SAMPLE = 4
+SAMPLES_PER_PATIENT = 2
+
+
+def write_manifest(path, num_rows, compress=False):
+    "Writes synthetic manifest with given number of lanes"
+
+    with (gzip.open(path, "wt") if compress else open(path, "w")) as f:
+        f.write("patient\tsample\tlane\tfq1\tfq2\n")
+        for i in range(num_rows):
+            sample = i // LANES_PER_SAMPLE
+            patient = sample // SAMPLES_PER_PATIENT
+            lane = i % LANES_PER_SAMPLE + 1
+            f.write(
+                f"P{patient}\tS{sample}\t{lane}\t"
+                f"S{sample}_L00{lane}_R1_001.fastq\t"
+                f"S{sample}_L00{lane}_R2_001.fastq\n"
+            )
+
+
+def parse(path):
+    "Parses manifest, returns cohort, elapsed seconds and peak memory in bytes"
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    cohort = build_cohort(read_manifest(path), os.path.basename(path))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cohort, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 500000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'format':>6} {'time [s]':>9} {'rows/s':>10} {'peak [MB]':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_rows in args.rows:
+            for compress in [False, True]:
+                path = os.path.join(tmp, f"manifest-{num_rows}.tsv")
+                path += ".gz" if compress else ""
+                write_manifest(path, num_rows, compress)
+
+                cohort, elapsed, peak = parse(path)
+                assert sum(len(s.lanes) for s in cohort.samples) == num_rows
+
+                print(
+                    f"{num_rows:>9} {'gzip' if compress else 'plain':>6} "
+                    f"{elapsed:>9.2f} {num_rows / elapsed:>10.0f} "
+                    f"{peak / 2**20:>10.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,19 @@
 import logging
 from freyja import Automation, Step, Input, List, Output, Optional
 from hephaestus import File, Project
-from sampleqc.manifest import load_manifest
+from sampleqc.manifest import load_manifest, stage_input_files
 from sampleqc.context import Context
-from sampleqc.steps import CollectAndUploadQCSummary
+from sampleqc.speculation import Speculation
+from sampleqc.steps import AppendToQCSummary, CollectAndUploadQCSummary
+from sampleqc.tracing import Tracer, traced
 from sampleqc.types import BamQCMetrics, ProcessedBam
-from sampleqc.utils import bam_qc_metrics_ok
+from sampleqc.utils import bam_qc_metrics_ok, hydrate_files
 from sampleqc.apps import (
     BWAmem,
     Trimgalore,
     PicardAlignmentSummaryMetrics,
     PicardMarkDuplicates,
+    SambambaMerge,
 )
 
 
@@ -52,21 +55,34 @@ class Main(Step):
         description="Tab-separated file containing collected QC metrics."
     )
 
+    @traced(container=True)
     def execute(self):
         "Main execution method. Execution starts here."
 
         # setup execution project, stage apps, ref files
         Context().initialize(project_name=self.project_name)
 
-        # parse manifest into cohort, import fastq files, set metadata
+        # parse manifest into cohort
         cohort = load_manifest(self.manifest_file)
 
-        # process samples in loop 
+        # process samples in loop as soon as their fastq files are
+        # imported and have metadata set (staging happens in chunks)
         # note: processing happens in parallel due to use of promises
-        processed_bams = [
-            ProcessSample(fastqs=s.fastqs, name_=s.id).processed_bam
-            for s in cohort.samples
-        ]
+        processed_bams = {}
+        for s in stage_input_files(cohort):
+            # step inputs of type List are passed as lists
+            processed_bam = ProcessSample(
+                fastqs=list(s.fastqs), name_=s.id
+            ).processed_bam
+            if self.config_.qc_summary.streaming:
+                # add row to QC summary as soon as sample is done
+                processed_bam = AppendToQCSummary(
+                    f"AppendToQCSummary-{s.id}", processed_bam=processed_bam
+                ).appended_bam
+            processed_bams[s] = processed_bam
+
+        # chunks are staged in order of completion, keep manifest order
+        processed_bams = [processed_bams[s] for s in cohort.samples]
 
         # collect BAM QC metrics and upload summary file
         self.qc_summary = CollectAndUploadQCSummary(
@@ -78,17 +94,65 @@ class Main(Step):
 
 
 class ProcessSample(Step):
-    "Processes a single sample"
+    """Processes a single sample. With 'scatter_lanes' set in config, each
+    lane is trimmed and aligned separately and lane BAMs are merged
+    afterwards. Lanes and reads are identified by file metadata."""
 
     fastqs = Input(List[File])
     processed_bam = Output(ProcessedBam)
 
+    @traced(container=True)
     def execute(self):
-        tg = Trimgalore(reads=self.fastqs, paired=True, fastqc=True)
-        filter = FilterFastq(input_fastq=tg.trimmed_reads)
-        aligned_bam = BWAmem(fastqs=filter.pass_fastq).merged_bam
+        if self.config_.scatter_lanes:
+            aligned_bam = self.align_lanes_separately()
+        else:
+            tg = Trimgalore(reads=self.fastqs, paired=True, fastqc=True)
+            filter = FilterFastq(input_fastq=tg.trimmed_reads)
+            aligned_bam = BWAmem(fastqs=filter.pass_fastq).merged_bam
         self.processed_bam = ProcessBam(input_bam=aligned_bam).processed_bam
 
+    def align_lanes_separately(self):
+        """Trims and aligns each lane in its own tasks, so that lanes
+        are processed in parallel and tasks are re-used per lane: if a lane
+        is added to a sample, only the new lane is aligned before the
+        merge. Lanes without FASTQ files passing QC are skipped. Returns
+        merged BAM."""
+
+        # group reads by lane
+        lanes = {}
+        for fq in hydrate_files(self.fastqs):
+            lane = int(fq.metadata["file_segment_number"])
+            lanes.setdefault(lane, []).append(fq)
+
+        # instantiate trimming of all lanes first so that lanes run in parallel
+        filtered = {}
+        for lane, reads in sorted(lanes.items()):
+            reads.sort(key=lambda fq: str(fq.metadata.get("paired_end")))  # R1, R2
+            tg = Trimgalore(
+                f"Trimgalore-L{lane}",
+                reads=reads,
+                paired=True,
+                fastqc=True,
+                lane=lane,
+            )
+            filter = FilterFastq(f"FilterFastq-L{lane}", input_fastq=tg.trimmed_reads)
+            filtered[lane] = filter.pass_fastq
+
+        lane_bams = []
+        for lane, pass_fastq in filtered.items():
+            pass_fastq = list(pass_fastq)  # wait for filtering of lane
+            if not pass_fastq:
+                logging.warning(f"{self.name_}: no FASTQ of lane {lane} passed QC")
+                continue
+            bwa = BWAmem(f"BWAmem-L{lane}", fastqs=pass_fastq, lane=lane)
+            lane_bams.append(bwa.merged_bam)
+
+        if not lane_bams:
+            raise Exception(f"No FASTQ files of sample {self.name_} passed QC")
+        if len(lane_bams) == 1:
+            return lane_bams[0]
+        return SambambaMerge(input_bams=lane_bams).merged_bam
+
 
 class FilterFastq(Step):
     "Filters out FASTq files not meeting QC criteria"
@@ -96,9 +160,13 @@ class FilterFastq(Step):
     input_fastq = Input(List[File])
     pass_fastq = Output(List[File])
 
+    @traced
     def execute(self):
+        with Tracer().span(self.name_, "graph wait: trimmed reads"):
+            input_fastq = list(self.input_fastq)
+
         self.pass_fastq = [
-            fq for fq in self.input_fastq
+            fq for fq in hydrate_files(input_fastq)
             if fq.size > self.config_.qc.min_fastq_size
         ]
 
@@ -108,20 +176,38 @@ class ProcessBam(Step):
     If mark duplicates is not required (static conditional) or
     BAM failed alignment QC (dynamic conditional), returns input BAM
     without further processing. Otherwise, runs deduplication and
-    return deduplicated BAM"""
+    return deduplicated BAM. With 'speculative_duplicate_marking' set
+    in config, deduplication starts right away alongside alignment QC
+    and is aborted if QC fails."""
         
     input_bam = Input(File)
     processed_bam = Output(ProcessedBam)
 
+    @traced(container=True)
     def execute(self):
 
+        speculative = (
+            self.config_.speculative_duplicate_marking
+            and not self.config_.skip_duplicate_marking
+        )
+
         asm = PicardAlignmentSummaryMetrics(input_bam=self.input_bam)
-        qc_failed = not bam_qc_metrics_ok(asm.qc_metrics, self.config_)
+        if speculative:
+            md = PicardMarkDuplicates(input_bam=self.input_bam)
+            md_task_name = PicardMarkDuplicates.task_name_for(self.input_bam)
+
+        with Tracer().span(self.name_, "graph wait: alignment QC"):
+            qc_failed = not bam_qc_metrics_ok(asm.qc_metrics, self.config_)
 
         if self.config_.skip_duplicate_marking or qc_failed:
+            if speculative:
+                Speculation().cancel(md_task_name)
             self.processed_bam = ProcessedBam(self.input_bam, asm.qc_metrics)
         else:
-            md = PicardMarkDuplicates(input_bam=self.input_bam)
+            if speculative:
+                Speculation().confirm(md_task_name)
+            else:
+                md = PicardMarkDuplicates(input_bam=self.input_bam)
             self.processed_bam = ProcessedBam(md.deduped_bam, asm.qc_metrics)
 
 
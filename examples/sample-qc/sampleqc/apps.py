@@ -1,78 +1,224 @@
 import datetime
 import logging
-from freyja import Input, Output, Step, List
-from hephaestus import FindOrCreateAndRunTask, File, Task
+import time
+from freyja import Input, Output, Step, List, Optional
+from hephaestus import FindOrCreateAndRunTask, File, SBApi, Task
 from sampleqc.context import Context
+from sampleqc.picard import read_metrics_row
+from sampleqc.polling import FINAL_STATUSES, TaskPoller
+from sampleqc.qcmetrics import EXTRA_METRIC_FIELDS
+from sampleqc.scheduler import SubmissionScheduler
+from sampleqc.speculation import Speculation
+from sampleqc.taskindex import ProjectTasks, TaskIndex, task_key
+from sampleqc.tracing import Tracer, traced
 from sampleqc.types import BamQCMetrics
+from sampleqc.utils import hydrate_files
 
 
 class AppStep(Step):
     """Base class for all steps executing apps on the SB platform.
-    Finished task is return on 'task' output."""
+    Finished task is return on 'task' output. Phases of task execution
+    are recorded in trace if tracing is enabled."""
     
     task = Output(Task)
 
-    def run_task(self, app_name, inputs, task_name=None):
+    def run_task(self, app_name, inputs, task_name=None, speculative=False):
         """Executes app on SB platform and returns finished task.
-        'app_name' must have defined app in automation config file."""
+        'app_name' must have defined app in automation config file.
+        Tasks that ran the same app revision on the same inputs before
+        are found in local task index first; only on a miss is the
+        platform queried for a matching task or a new task created.
+
+        Speculative tasks are registered by task name and can be cancelled
+        through Speculation(). If cancelled, returns None without setting
+        'task' output, and the step should set its outputs to None."""
 
         ctx = Context()
+        tracer = Tracer()
         if not task_name:
             task_name = self.name_
 
-        self.task = FindOrCreateAndRunTask(
-            new_name=task_name + " - "
-                + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            inputs=inputs,
+        index = TaskIndex()
+        with tracer.span(self.name_, "task index lookup"):
+            key = task_key(ctx.project, ctx.apps[app_name], inputs)
+            task = index.find_task(key)
+        if task:
+            logging.info(f"Re-using task '{task.name}' from local task index")
+            self.task = task
+            return task
+
+        new_name = (
+            task_name + " - " + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        )
+        # number of tasks in flight is bounded per app and overall
+        scheduler = SubmissionScheduler()
+        with tracer.span(self.name_, "submission slot wait", app=app_name):
+            scheduler.acquire(app_name, inputs)
+
+        submitted = time.time()
+        try:
+            with tracer.span(self.name_, "run task", app=app_name):
+                if speculative:
+                    task = self.create_and_run_speculative_task(
+                        new_name, app_name, inputs, task_name
+                    )
+                elif ctx.config.task_polling.bulk:
+                    task = self.create_and_run_task(new_name, app_name, inputs)
+                else:
+                    task = FindOrCreateAndRunTask(
+                        new_name=new_name,
+                        inputs=inputs,
+                        app=ctx.apps[app_name],
+                        in_project=ctx.project,
+                    ).finished_task
+                    # wait for task, so that submission slot is held until
+                    # it has finished
+                    task.id
+        finally:
+            scheduler.release(app_name)
+
+        if not task:
+            logging.info(f"Speculative task '{task_name}' was cancelled")
+            return
+
+        tracer.add_task_phases(self.name_, task, since=submitted)
+        with tracer.span(self.name_, "output fetch"):
+            task.outputs
+
+        index.record(key, task.id)
+        self.task = task
+        return task
+
+    def create_and_run_task(self, name, app_name, inputs):
+        """Finds or creates and runs task, then waits for it to finish using
+        the shared task poller. Like FindOrCreateAndRunTask, re-uses
+        matching task in project if there is one, see ProjectTasks."""
+
+        task = self.find_or_create_task(name, app_name, inputs)
+        if task.status not in FINAL_STATUSES:
+            task = TaskPoller().wait(task, app_name)
+
+        if task.status != "COMPLETED":
+            raise Exception(f"Task '{task.name}' finished with status {task.status}")
+        return task
+
+    def find_or_create_task(self, name, app_name, inputs):
+        "Returns matching task in project, or newly created and started task"
+
+        ctx = Context()
+        task = ProjectTasks().find(ctx.project, ctx.apps[app_name], inputs)
+        if task:
+            logging.info(f"Re-using task '{task.name}' found in project")
+            return task
+
+        return SBApi().tasks.create(
+            name=name,
+            project=ctx.project,
             app=ctx.apps[app_name],
-            in_project=ctx.project,
-        ).finished_task
+            inputs=inputs,
+            run=True,
+        )
+
+    def create_and_run_speculative_task(self, name, app_name, inputs, task_name):
+        """Like create_and_run_task, but registers task with Speculation()
+        under 'task_name'. Returns None if task was cancelled, either
+        before it was created or while it was running."""
+
+        speculation = Speculation()
+        if speculation.is_cancelled(task_name):
+            return None
+
+        task = self.find_or_create_task(name, app_name, inputs)
+        if task.status not in FINAL_STATUSES:
+            if not speculation.start(task_name, task):
+                return None
+            task = TaskPoller().wait(task, app_name)
+            speculation.finish(task_name, task)
+
+        if task.status != "COMPLETED":
+            if speculation.is_cancelled(task_name):
+                return None
+            raise Exception(f"Task '{task.name}' finished with status {task.status}")
+        return task
 
 
 class BWAmem(AppStep):
+    "Aligns FASTQ files of all lanes of a sample, or of a single 'lane'"
+
     fastqs = Input(List[File])
+    lane = Input(Optional[int])
     merged_bam = Output(File)
 
+    @traced
     def execute(self):
         ctx = Context()
+        fastqs = hydrate_files(self.fastqs)
         self.run_task(
             app_name="bwa",
             inputs={
-                "FASTQ": self.fastqs, 
+                "FASTQ": fastqs, 
                 "Input_reference": ctx.refs["bwa_bundle"]
             },
-            task_name="BWAmem-" + self.fastqs[0].metadata["sample_id"],
+            task_name="BWAmem-" + fastqs[0].metadata["sample_id"]
+            + (f"-L{self.lane}" if self.lane else ""),
         )
 
         self.merged_bam = self.task.outputs["merged_bam"]
 
 
 class Trimgalore(AppStep):
+    "Trims reads of all lanes of a sample, or of a single 'lane'"
+
     reads = Input(List[File])
     paired = Input(bool)
     fastqc = Input(bool)
+    lane = Input(Optional[int])
     trimmed_reads = Output(List[File])
 
+    @traced
     def execute(self):
+        reads = hydrate_files(self.reads)
         self.run_task(
             app_name="trimgalore",
             inputs={
-                "reads": self.reads, 
+                "reads": reads, 
                 "paired": self.paired, 
                 "fastqc": self.fastqc
             },
-            task_name="Trimgalore-" + self.reads[0].metadata["sample_id"],
+            task_name="Trimgalore-" + reads[0].metadata["sample_id"]
+            + (f"-L{self.lane}" if self.lane else ""),
         )
 
         self.trimmed_reads = self.task.outputs["trimmed_reads"]
 
 
+class SambambaMerge(AppStep):
+    "Merges BAM files of separately aligned lanes of a sample"
+
+    input_bams = Input(List[File])
+    merged_bam = Output(File)
+
+    @traced
+    def execute(self):
+        input_bams = hydrate_files(self.input_bams)
+        self.run_task(
+            app_name="merge",
+            inputs={
+                "bams": input_bams
+            },
+            task_name="Merge-" + input_bams[0].metadata["sample_id"],
+        )
+
+        self.merged_bam = self.task.outputs["merged_bam"]
+
+
 class PicardAlignmentSummaryMetrics(AppStep):
     input_bam = Input(File)
 
     summary_metrics_file = Output(File)
     qc_metrics = Output(BamQCMetrics)
 
+    @traced
     def execute(self):
         ctx = Context()
         self.run_task(
@@ -93,28 +239,50 @@ class PicardAlignmentSummaryMetrics(AppStep):
     def parse_qc_from_metrics_file(self):
         "reads QC metrics from picard output file into QC object"
 
-        for line in self.summary_metrics_file.content().split('\n'):
-            if not line.startswith("PAIR"):
-                continue
-            record = line.strip().split("\t")
+        with Tracer().span(self.name_, "metrics parsing"):
+            record = read_metrics_row(self.summary_metrics_file, "CATEGORY", "PAIR")
 
-            return BamQCMetrics(
-                pct_pf_reads_aligned=float(record[6]),
-                strand_balance=float(record[19]),
-            )
+        # additional metrics are optional, Picard writes '?' for undefined
+        extra_metrics = {}
+        for name in EXTRA_METRIC_FIELDS:
+            value = record.get(name.upper(), "")
+            if value and value != "?":
+                extra_metrics[name] = float(value)
+
+        return BamQCMetrics(
+            pct_pf_reads_aligned=float(record["PCT_PF_READS_ALIGNED"]),
+            strand_balance=float(record["STRAND_BALANCE"]),
+            **extra_metrics
+        )
 
 
 class PicardMarkDuplicates(AppStep):
+    """Marks duplicates. With 'speculative_duplicate_marking' set in
+    config, the task can be cancelled by name, see task_name_for().
+    Outputs of a cancelled task are None."""
+
     input_bam = Input(File)
-    deduped_bam = Output(File)
+    deduped_bam = Output(Optional[File])
+    task = Output(Optional[Task])
 
+    @staticmethod
+    def task_name_for(input_bam):
+        return "MarkDup-" + input_bam.metadata["sample_id"]
+
+    @traced
     def execute(self):
-        self.run_task(
+        task = self.run_task(
             app_name="markdup",
             inputs={
                 "input_bam": [self.input_bam]
             },
-            task_name="MarkDup-" + self.input_bam.metadata["sample_id"],
+            task_name=self.task_name_for(self.input_bam),
+            speculative=self.config_.speculative_duplicate_marking,
         )
+        if not task:
+            # cancelled, result not needed
+            self.task = None
+            self.deduped_bam = None
+            return
 
         self.deduped_bam = self.task.outputs["deduped_bam"]
@@ -0,0 +1,56 @@
+"""
+Per-user local cache for data that is expensive to fetch from the
+platform or to compute, such as parsed manifest files. Entries are
+pickled into files named after a hash of their key, below the
+directory configured as 'local_cache_dir' in the config file. Entries
+that cannot be unpickled, e.g. after classes changed, count as misses.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+from sampleqc.context import Context
+
+# part of every key, increase when layout of cached objects changes
+CACHE_VERSION = 3
+
+
+def cache_dir(kind):
+    "Returns cache directory for given kind of entries, creates it if needed"
+
+    path = os.path.join(os.path.expanduser(Context().config.local_cache_dir), kind)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_path(kind, key):
+    digest = hashlib.sha1(repr((CACHE_VERSION, key)).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(kind), digest + ".pickle")
+
+
+def load(kind, key):
+    "Returns cached object for key, or None if not cached"
+
+    try:
+        with open(cache_path(kind, key), "rb") as f:
+            return pickle.load(f)
+    except (
+        OSError,
+        EOFError,
+        pickle.UnpicklingError,
+        AttributeError,
+        TypeError,
+        ImportError,
+    ):
+        return None
+
+
+def store(kind, key, obj):
+    "Caches object for key. Writes atomically, safe for concurrent runs."
+
+    path = cache_path(kind, key)
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, path)
@@ -1,3 +1,6 @@
+from array import array
+
+
 class Cohort:
     "Group of patients to be analyzed"
 
@@ -6,20 +9,27 @@ class Cohort:
 
         self.manifest_file = manifest_file
         self.patients = []
+        self._patients_by_id = {}
+        self._samples_by_id = {}
 
     def get_sample_by_id(self, id):
-        sample = [s for p in self.patients for s in p.samples if s.id == id]
-        return sample[0] if sample else None
+        return self._samples_by_id.get(id)
 
     def get_patient_by_id(self, id):
-        patient = [p for p in self.patients if p.id == id]
-        return patient[0] if patient else None
+        return self._patients_by_id.get(id)
 
     def add_patient(self, patient):
         if self.get_patient_by_id(patient.id):
             raise Exception("Cohort already has patient with ID %s" % patient.id)
         self.patients.append(patient)
+        self._patients_by_id[patient.id] = patient
         patient.cohort = self
+        for sample in patient.samples:
+            self._index_sample(sample)
+
+    def _index_sample(self, sample):
+        "Called by patients when adding samples. First sample with ID wins."
+        self._samples_by_id.setdefault(sample.id, sample)
 
     @property
     def samples(self):
@@ -47,10 +57,10 @@ class Patient:
         self.id = id
         self.samples = []
         self.cohort = None
+        self._samples_by_id = {}
 
     def get_sample_by_id(self, id):
-        sample = [s for s in self.samples if s.id == id]
-        return sample[0] if sample else None
+        return self._samples_by_id.get(id)
 
     def add_sample(self, sample):
         if self.get_sample_by_id(sample.id):
@@ -58,37 +68,81 @@ class Patient:
                 "Patient %s already has sample with ID %s" % (self.id, sample.id)
             )
         self.samples.append(sample)
+        self._samples_by_id[sample.id] = sample
         sample.patient = self
+        if self.cohort:
+            self.cohort._index_sample(sample)
 
     def __repr__(self):
         return "<Patient: id=%s samples=%s>" % (self.id, self.samples)
 
 
 class Sample:
-    """Sample with one or more associated sequencing lanes. This class 
-    can also be used as container for per-sample processing results."""
+    """Sample with one or more associated sequencing lanes. Attributes are
+    fixed by __slots__ to keep memory low for large cohorts, so processing
+    results cannot be attached to samples; keep them in step outputs.
+
+    If a LaneTable is given, lanes are stored in this table and the
+    sample only keeps row numbers; 'lanes' then returns views onto
+    the table. Lanes and FASTQ files are returned as tuples, which are
+    cached until lanes change, so that callers cannot bypass add_lane()."""
+
+    __slots__ = (
+        "id",
+        "type",
+        "source",
+        "patient",
+        "_lanes",
+        "_table",
+        "_lane_tuple",
+        "_fastqs",
+    )
 
-    def __init__(self, id, type=None, source=None):
+    def __init__(self, id, type=None, source=None, lane_table=None):
         self.id = id
         self.type = type  # tumor type
         self.source = source  # tumor or normal
-        self.lanes = []
         self.patient = None
+        self._table = lane_table
+        self._lanes = [] if lane_table is None else array("l")
+        self._lane_tuple = None
+        self._fastqs = None
+
+    @property
+    def lanes(self):
+        if self._lane_tuple is None:
+            if self._table is None:
+                self._lane_tuple = tuple(self._lanes)
+            else:
+                self._lane_tuple = tuple(
+                    LaneView(self._table, row) for row in self._lanes
+                )
+        return self._lane_tuple
 
     def add_lane(self, lane):
-        self.lanes.append(lane)
-        lane.sample = self
+        """Adds lane to sample. With a lane table, the lane is copied
+        into the table and should no longer be used directly."""
+
+        if self._table is None:
+            self._lanes.append(lane)
+            lane.sample = self
+        else:
+            self._lanes.append(self._table.append(lane, self))
+        self._lane_tuple = None
+        self._fastqs = None
 
     @property
     def multilane(self):
-        return len(self.lanes) > 1
+        return len(self._lanes) > 1
 
     @property
     def fastqs(self):
-        fqs = []
-        for l in self.lanes:
-            fqs.extend([l.fq1, l.fq2])
-        return fqs
+        if self._fastqs is None:
+            fqs = []
+            for l in self.lanes:
+                fqs.extend([l.fq1, l.fq2])
+            self._fastqs = tuple(fqs)
+        return self._fastqs
 
     def __repr__(self):
         return "<Sample: id=%s type=%s source=%s lane=%s patient=%s>" % (
@@ -100,9 +154,47 @@ class Sample:
         )
 
 
-class Lane:
+class BaseLane:
+    "Behavior shared by standalone lanes and lane table views"
+
+    __slots__ = ()
+
+    @property
+    def id(self):
+        id = self.sample.id
+        if self.sample.multilane:
+            id += ": " + str(self.read_group)
+        return id
+
+    def _fastqs_changed(self):
+        if self.sample:
+            self.sample._fastqs = None
+
+    def __repr__(self):
+        return "<Lane: read_group=%s fq1=%s fq2=%s FN=%s LB=%s PU=%s sample=%s>" % (
+            self.read_group,
+            self.fq1,
+            self.fq2,
+            self.file_name_root,
+            self.library_name,
+            self.processing_unit,
+            self.sample.id if self.sample else None,
+        )
+
+
+class Lane(BaseLane):
     """Pair of fastq files from single sequencing lane"""
 
+    __slots__ = (
+        "read_group",
+        "_fq1",
+        "_fq2",
+        "file_name_root",
+        "library_name",
+        "processing_unit",
+        "sample",
+    )
+
     def __init__(
         self,
         read_group=1,
@@ -113,27 +205,101 @@ class Lane:
         processing_unit=None,
     ):
         self.read_group = int(read_group)
+        self.sample = None
         self.fq1 = fq1
         self.fq2 = fq2
         self.file_name_root = file_name_root
         self.library_name = library_name
         self.processing_unit = processing_unit
-        self.sample = None
 
     @property
-    def id(self):
-        id = self.sample.id
-        if self.sample.multilane:
-            id += ": " + str(self.read_group)
-        return id
+    def fq1(self):
+        return self._fq1
 
-    def __repr__(self):
-        return "<Lane: read_group=%s fq1=%s fq2=%s FN=%s LB=%s PU=%s sample=%s>" % (
-            self.read_group,
-            self.fq1,
-            self.fq2,
-            self.file_name_root,
-            self.library_name,
-            self.processing_unit,
-            self.sample.id if self.sample else None,
-        )
+    @fq1.setter
+    def fq1(self, fq):
+        self._fq1 = fq
+        self._fastqs_changed()
+
+    @property
+    def fq2(self):
+        return self._fq2
+
+    @fq2.setter
+    def fq2(self, fq):
+        self._fq2 = fq
+        self._fastqs_changed()
+
+
+class LaneTable:
+    """Column-oriented storage for the lanes of very large cohorts.
+    Instead of one object per lane, each lane attribute is kept in
+    a column, with read groups in a compact integer array. Samples
+    reference their lanes by row number."""
+
+    __slots__ = (
+        "read_group",
+        "fq1",
+        "fq2",
+        "file_name_root",
+        "library_name",
+        "processing_unit",
+        "sample",
+    )
+
+    def __init__(self):
+        self.read_group = array("l")
+        self.fq1 = []
+        self.fq2 = []
+        self.file_name_root = []
+        self.library_name = []
+        self.processing_unit = []
+        self.sample = []
+
+    def append(self, lane, sample):
+        "Copies lane into table and returns its row number"
+
+        self.read_group.append(lane.read_group)
+        self.fq1.append(lane.fq1)
+        self.fq2.append(lane.fq2)
+        self.file_name_root.append(lane.file_name_root)
+        self.library_name.append(lane.library_name)
+        self.processing_unit.append(lane.processing_unit)
+        self.sample.append(sample)
+        return len(self.sample) - 1
+
+    def __len__(self):
+        return len(self.sample)
+
+
+def _column(name, fastq=False):
+    "Returns property reading and writing a lane table column"
+
+    def get(view):
+        return getattr(view._table, name)[view._row]
+
+    def set(view, value):
+        getattr(view._table, name)[view._row] = value
+        if fastq:
+            view._fastqs_changed()
+
+    return property(get, set)
+
+
+class LaneView(BaseLane):
+    """Lane stored in a LaneTable. Views are created when lanes of a
+    sample are first accessed and hold no lane data themselves."""
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    read_group = _column("read_group")
+    fq1 = _column("fq1", fastq=True)
+    fq2 = _column("fq2", fastq=True)
+    file_name_root = _column("file_name_root")
+    library_name = _column("library_name")
+    processing_unit = _column("processing_unit")
+    sample = _column("sample")
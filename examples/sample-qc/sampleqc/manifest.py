@@ -1,107 +1,259 @@
 import os, tempfile
+import gzip
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from hephaestus import SBApi
 from hephaestus.steps import FindOrCopyFiles, FindOrCopyFilesByName, SetMetadataBulk
+from sampleqc import cache
 from sampleqc.context import Context
-from sampleqc.entities import Cohort, Patient, Sample, Lane
+from sampleqc.entities import Cohort, Patient, Sample, Lane, LaneTable
+from sampleqc.utils import metadata_up_to_date
+
+MANIFEST_COLUMNS = ["patient", "sample", "lane", "fq1", "fq2"]
+MAX_REPORTED_ERRORS = 50
 
 
 def load_manifest(manifest_file):
     """Parses given manifest file into cohort object structure. Not
     implemented as step but as regular Python functions because
-    there is no need to parallelize this part of the automation."""
-
-    def load(manifest_file):
-
-        cohort = parse_manifest_into_cohort(manifest_file)
-        stage_input_files_in_bulk(cohort)
-        set_metadata_in_bulk(cohort)
-
-        return cohort
+    there is no need to parallelize this part of the automation.
+    Input files are staged separately with stage_input_files()."""
 
     def parse_manifest_into_cohort(manifest_file):
 
         logging.info(f"Reading manifest file: '{manifest_file.name}'")
 
-        # copy manifest into analysis project and parse content
+        # copy manifest into analysis project
         FindOrCopyFiles(
             f"CopyManifest",
             files=[manifest_file],
             to_project=Context().project,
         ).copied_files[0]
-        filename = tempfile.gettempdir() + "/manifest.txt"
-        manifest_file.download(path=filename, overwrite=True)
 
-        cohort = Cohort(manifest_file=manifest_file.name)
+        # re-use cohort parsed during earlier run if manifest did not change
+        compact_lanes = Context().config.compact_lanes
+        key = (manifest_file.id, str(manifest_file.modified_on), compact_lanes)
+        cohort = cache.load("manifests", key)
+        if cohort:
+            logging.info("  Using cached cohort, manifest unchanged since last run.")
+            return cohort
 
-        num_entries = 0
-        with open(str(filename), "r") as f:
-            for line_no, line in enumerate(f.readlines()):
+        # download into unique location so that concurrent runs don't clash
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, "manifest.txt")
+            manifest_file.download(path=filename, overwrite=True)
 
-                if line_no == 0:  # skip header
-                    continue
+            lane_table = LaneTable() if compact_lanes else None
+            cohort = build_cohort(
+                read_manifest(filename), manifest_file.name, lane_table
+            )
+
+        cache.store("manifests", key, cohort)
+        return cohort
+
+    return parse_manifest_into_cohort(manifest_file)
+
+
+def stage_input_files(cohort):
+    """Copies input files of all samples to execution project and sets
+    their metadata, in bulk to save API calls. Samples are split into
+    chunks of about 'staging_chunk_size' files that are copied concurrently.
+    Generator that yields samples as soon as their chunk has been staged,
+    in the order in which chunks complete, so that processing of early
+    samples can start while later chunks are still being copied."""
+
+    ctx = Context()
+
+    fastq_project = SBApi().projects.get(id=ctx.config.fastq_project)
+
+    chunks = list(chunk_samples(cohort.samples, ctx.config.staging_chunk_size))
+
+    # instantiate all copy steps first so that they execute concurrently
+    copy_steps = [
+        FindOrCopyFilesByName(
+            f"StageInputFiles-{idx}",
+            names=[f for s in samples for f in s.fastqs],
+            from_project=fastq_project,
+            to_project=ctx.project,
+        )
+        for idx, samples in enumerate(chunks)
+    ]
+
+    def staged_files(copy_step):
+        "Waits for copy step, returns dict with file name -> staged file"
+        return {f.name: f for f in copy_step.copied_files}
+
+    # wait for copy steps in worker threads, so that a slow chunk does not
+    # hold back chunks that completed after it
+    with ThreadPoolExecutor(max_workers=max(len(copy_steps), 1)) as pool:
+        futures = {
+            pool.submit(staged_files, copy_step): idx
+            for idx, copy_step in enumerate(copy_steps)
+        }
+        for future in as_completed(futures):
+            idx = futures[future]
+            samples, files = chunks[idx], future.result()
+
+            for sample in samples:
+                for lane in sample.lanes:
+                    lane.fq1 = files[lane.fq1]
+                    lane.fq2 = files[lane.fq2]
+
+            set_metadata_in_bulk(samples, f"SetMetadata-{idx}")
 
-                if line.strip().startswith("#"):
+            logging.info(
+                f"  Staged input files of {len(samples)} samples (chunk {idx})."
+            )
+            yield from samples
+
+
+def chunk_samples(samples, chunk_size):
+    "Groups samples into lists with about 'chunk_size' FASTQ files each"
+
+    chunk, num_files = [], 0
+    for sample in samples:
+        chunk.append(sample)
+        num_files += len(sample.fastqs)
+        if num_files >= chunk_size:
+            yield chunk
+            chunk, num_files = [], 0
+    if chunk:
+        yield chunk
+
+
+def set_metadata_in_bulk(samples, step_name):
+    """Sets metadata for all input files of samples in bulk to save API
+    calls. Waits for the update, so that files carry their metadata when
+    sample processing starts. If 'skip_unchanged_metadata' is set in config,
+    files that already have the desired metadata, e.g. during re-runs,
+    are not updated at all."""
+
+    skip_unchanged = Context().config.skip_unchanged_metadata
+
+    files_to_update, metadata_records, num_files = [], [], 0
+    for sample in samples:
+        for lane in sample.lanes:
+            for paired_end, fq in [("1", lane.fq1), ("2", lane.fq2)]:
+                metadata = {
+                    "sample_id": sample.id,
+                    "file_segment_number": lane.read_group,
+                    "paired_end": paired_end,
+                }
+                num_files += 1
+                if skip_unchanged and metadata_up_to_date(fq, metadata):
                     continue
+                files_to_update.append(fq)
+                metadata_records.append(metadata)
 
-                patient_id, sample_id, read_group, fq1, fq2 = line.strip().split("\t")
+    if skip_unchanged:
+        logging.info(
+            f"  Metadata already up to date for {num_files - len(files_to_update)}"
+            f" of {num_files} files, skipped these metadata writes."
+        )
+    if not files_to_update:
+        return
 
-                patient = cohort.get_patient_by_id(patient_id)
-                if not patient:
-                    patient = Patient(patient_id)
-                    cohort.add_patient(patient)
+    updated_files = SetMetadataBulk(
+        step_name, to_files=files_to_update, metadata=metadata_records, keep_old=True
+    ).updated_files
 
-                sample = patient.get_sample_by_id(sample_id)
-                if not sample:
-                    sample = Sample(sample_id)
-                    patient.add_sample(sample)
+    updated_files = {f.name: f for f in updated_files}
+    for sample in samples:
+        for lane in sample.lanes:
+            lane.fq1 = updated_files.get(lane.fq1.name, lane.fq1)
+            lane.fq2 = updated_files.get(lane.fq2.name, lane.fq2)
 
-                lane = Lane(read_group=read_group, fq1=fq1, fq2=fq2)
-                sample.add_lane(lane)
 
-                num_entries += 1
+def build_cohort(rows, manifest_name, lane_table=None):
+    """Builds cohort object structure from manifest rows. Lanes are
+    stored in lane table if given (compact representation)."""
 
-        logging.info("  %d manifest entries read." % num_entries)
+    cohort = Cohort(manifest_file=manifest_name)
 
-        return cohort
+    num_entries = 0
+    for row in rows:
+        patient = cohort.get_patient_by_id(row["patient"])
+        if not patient:
+            patient = Patient(row["patient"])
+            cohort.add_patient(patient)
 
-    def stage_input_files_in_bulk(cohort):
-        "Copy all input files to execution project in bulk to save API calls"
+        sample = patient.get_sample_by_id(row["sample"])
+        if not sample:
+            sample = Sample(row["sample"], lane_table=lane_table)
+            patient.add_sample(sample)
 
-        ctx = Context()
+        lane = Lane(read_group=row["lane"], fq1=row["fq1"], fq2=row["fq2"])
+        sample.add_lane(lane)
 
-        fastq_project = SBApi().projects.get(id=ctx.config.fastq_project)
+        num_entries += 1
 
-        files_to_stage = [
-            f for s in cohort.samples for l in s.lanes for f in [l.fq1, l.fq2]
-        ]
+    logging.info("  %d manifest entries read." % num_entries)
 
-        staged_files = FindOrCopyFilesByName(
-            names=files_to_stage, from_project=fastq_project, to_project=ctx.project
-        ).copied_files
+    return cohort
 
-        staged_files = {f.name: f for f in staged_files}
 
-        for sample in cohort.samples:
-            for lane in sample.lanes:
-                lane.fq1 = staged_files[lane.fq1]
-                lane.fq2 = staged_files[lane.fq2]
+def read_manifest(filename):
+    """Generator that streams rows of a tab-separated manifest file as dicts
+    keyed by column name. Reads gzip-compressed files transparently.
+    Columns are looked up by header name, so column order does not matter
+    and additional columns are ignored. Invalid rows are collected and
+    reported together in one exception after the whole file has been read."""
 
-    def set_metadata_in_bulk(cohort):
-        "Sets metadata for all input files in bulk to save API calls"
+    errors = []
+    with open_manifest(filename) as f:
+        header = f.readline().rstrip("\r\n").split("\t")
+        header = [c.strip().lower() for c in header]
+        missing = [c for c in MANIFEST_COLUMNS if c not in header]
+        if missing:
+            raise Exception(
+                "Manifest header is missing required columns: %s"
+                % ", ".join(missing)
+            )
+        index = {c: header.index(c) for c in MANIFEST_COLUMNS}
 
-        files_to_update, metadata_records = [], []
-        for sample in cohort.samples:
-            for lane in sample.lanes:
-                files_to_update.extend([lane.fq1, lane.fq2])
-                metadata_records.extend(
-                    [{"sample_id": sample.id, "file_segment_number": lane.read_group}]
-                    * 2
+        for line_no, line in enumerate(f, start=2):
+
+            if not line.strip() or line.strip().startswith("#"):
+                continue
+
+            values = line.rstrip("\r\n").split("\t")
+            row = {
+                c: values[i].strip() if i < len(values) else ""
+                for c, i in index.items()
+            }
+
+            empty = [c for c in MANIFEST_COLUMNS if not row[c]]
+            if empty:
+                errors.append(
+                    "line %d: missing value for %s" % (line_no, ", ".join(empty))
                 )
+                continue
+            if not row["lane"].isdigit():
+                errors.append(
+                    "line %d: lane must be a number, got '%s'"
+                    % (line_no, row["lane"])
+                )
+                continue
+
+            yield row
 
-        SetMetadataBulk(
-            to_files=files_to_update, metadata=metadata_records, keep_old=True
+    if errors:
+        raise Exception(
+            "Manifest contains %d invalid rows:\n  %s%s"
+            % (
+                len(errors),
+                "\n  ".join(errors[:MAX_REPORTED_ERRORS]),
+                "\n  ..." if len(errors) > MAX_REPORTED_ERRORS else "",
+            )
         )
 
-    cohort = load(manifest_file)
-    return cohort
+
+def open_manifest(filename):
+    "Opens manifest file for reading text, decompressing gzip files on the fly"
+
+    with open(filename, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+
+    if compressed:
+        return gzip.open(filename, "rt")
+    return open(filename, "r")
@@ -0,0 +1,168 @@
+"""
+Columnar store for alignment QC metrics of a whole cohort. Each metric is
+kept in a NumPy array with one entry per sample, so that QC cutoffs,
+cohort statistics and outlier flags are evaluated for all samples at once.
+Tables are persisted locally as compressed .npz file at the end of each
+run, which allows re-evaluating QC cutoffs without re-running the
+automation and without any platform calls:
+
+    python -m sampleqc.qcmetrics <table.npz> [--min_pct_pf_reads_aligned 0.99]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+# metrics used by QC cutoffs, followed by additional Picard metrics
+QC_METRIC_FIELDS = ["pct_pf_reads_aligned", "strand_balance"]
+EXTRA_METRIC_FIELDS = [
+    "total_reads",
+    "mean_read_length",
+    "pct_reads_aligned_in_pairs",
+    "pct_chimeras",
+    "pct_adapter",
+]
+METRIC_FIELDS = QC_METRIC_FIELDS + EXTRA_METRIC_FIELDS
+
+OUTLIER_THRESHOLD = 3.5  # robust z-score above which a value is an outlier
+
+
+class QCMetricsTable:
+    """QC metrics with one float64 column per metric and one row per
+    sample. Missing values are stored as NaN."""
+
+    def __init__(self, sample_ids, columns):
+        self.sample_ids = np.asarray(sample_ids, dtype=str)
+        self.columns = {
+            name: np.asarray(columns[name], dtype=np.float64) for name in METRIC_FIELDS
+        }
+
+    @classmethod
+    def from_metrics(cls, sample_ids, metrics):
+        "Builds table from sample IDs and corresponding BamQCMetrics objects"
+
+        columns = {
+            name: [
+                np.nan if getattr(m, name, None) is None else getattr(m, name)
+                for m in metrics
+            ]
+            for name in METRIC_FIELDS
+        }
+        return cls(sample_ids, columns)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            missing = np.full(len(data["sample_id"]), np.nan)
+            columns = {
+                name: data[name] if name in data else missing
+                for name in METRIC_FIELDS
+            }
+            return cls(data["sample_id"], columns)
+
+    def save(self, path):
+        "Writes table as compressed .npz file. Writes atomically."
+
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, sample_id=self.sample_ids, **self.columns)
+        os.replace(temp, path)
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    def passes(self, min_pct_pf_reads_aligned, min_strand_balance):
+        """Returns boolean array, true for samples passing QC cutoffs.
+        Same criteria as bam_qc_metrics_ok(), for all samples at once."""
+
+        return (self.columns["pct_pf_reads_aligned"] >= min_pct_pf_reads_aligned) & (
+            np.abs(self.columns["strand_balance"]) >= min_strand_balance
+        )
+
+    def statistics(self):
+        """Returns dict with cohort statistics per metric: number of samples
+        with value, mean, standard deviation, median, minimum and maximum"""
+
+        stats = {}
+        for name, values in self.columns.items():
+            values = values[~np.isnan(values)]
+            if not len(values):
+                stats[name] = {"count": 0}
+                continue
+            stats[name] = {
+                "count": len(values),
+                "mean": float(values.mean()),
+                "std": float(values.std()),
+                "median": float(np.median(values)),
+                "min": float(values.min()),
+                "max": float(values.max()),
+            }
+        return stats
+
+    def outliers(self, threshold=OUTLIER_THRESHOLD):
+        """Returns dict with boolean array per metric, true for samples whose
+        robust z-score (based on median and median absolute deviation) is
+        above threshold. Metrics without spread flag no outliers."""
+
+        flags = {}
+        for name, values in self.columns.items():
+            flags[name] = np.zeros(len(values), dtype=bool)
+            present = ~np.isnan(values)
+            if not present.any():
+                continue
+            median = np.median(values[present])
+            mad = np.median(np.abs(values[present] - median))
+            if mad == 0:
+                continue
+            z = 0.6745 * np.abs(values[present] - median) / mad
+            flags[name][present] = z > threshold
+        return flags
+
+    def outlier_samples(self, threshold=OUTLIER_THRESHOLD):
+        "Returns dict with sample ID -> list of metrics flagged as outliers"
+
+        flags = self.outliers(threshold)
+        flagged = np.logical_or.reduce(list(flags.values()))
+        return {
+            sample_id: [name for name in METRIC_FIELDS if flags[name][i]]
+            for i, sample_id in zip(np.flatnonzero(flagged), self.sample_ids[flagged])
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-evaluates QC cutoffs on stored cohort QC metrics."
+    )
+    parser.add_argument("table", help="QC metrics table (.npz) written by automation")
+    parser.add_argument("--min_pct_pf_reads_aligned", type=float, default=0.998)
+    parser.add_argument("--min_strand_balance", type=float, default=0.49)
+    parser.add_argument("--outlier_threshold", type=float, default=OUTLIER_THRESHOLD)
+    args = parser.parse_args()
+
+    table = QCMetricsTable.load(args.table)
+
+    start = time.perf_counter()
+    passed = table.passes(args.min_pct_pf_reads_aligned, args.min_strand_balance)
+    stats = table.statistics()
+    outliers = table.outlier_samples(args.outlier_threshold)
+    elapsed = time.perf_counter() - start
+
+    print(f"{passed.sum()} of {len(table)} samples pass QC ({elapsed * 1000:.1f} ms)")
+    print(
+        f"{'metric':>28} {'count':>7} {'mean':>12} {'median':>12}"
+        f" {'min':>12} {'max':>12}"
+    )
+    for name, s in stats.items():
+        if s["count"]:
+            print(
+                f"{name:>28} {s['count']:>7} {s['mean']:>12.4g} {s['median']:>12.4g}"
+                f" {s['min']:>12.4g} {s['max']:>12.4g}"
+            )
+    for sample_id, names in outliers.items():
+        print(f"outlier: {sample_id} ({', '.join(names)})")
+
+
+if __name__ == "__main__":
+    main()
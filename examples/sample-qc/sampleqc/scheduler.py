@@ -0,0 +1,94 @@
+"""
+Bounded submission of platform tasks. Every AppStep asks the scheduler
+for a slot before creating its task and holds it until the task has
+finished, which limits the number of tasks in flight per app and overall.
+Waiting requests are granted free slots longest estimated work first,
+i.e. apps with the longest estimated duration first and, within an app,
+tasks with the largest inputs first. Limits and estimates are read from
+the 'apps' and 'task_submission' sections of the config file.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+from freyja.graph import Singleton
+from sampleqc.context import Context
+
+
+class SubmissionScheduler(metaclass=Singleton):
+    """Grants submission slots to waiting steps. Requests are queued
+    per app, so that picking the next request only needs to look at
+    the head of each app queue."""
+
+    def __init__(self):
+        config = Context().config
+        self.max_in_flight = config.task_submission.max_in_flight
+        self.app_limits, self.app_estimates = {}, {}
+        for app_name, app in config.apps.data.items():
+            if isinstance(app, dict):
+                self.app_limits[app_name] = app.get("max_in_flight")
+                self.app_estimates[app_name] = app.get("estimated_duration", 0)
+        self.in_flight = {}  # app name -> number of tasks
+        self.total_in_flight = 0
+        self.queues = {}  # app name -> heap of waiting requests
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def acquire(self, app_name, inputs):
+        """Blocks until task for app may be submitted. Every call must be
+        followed by release() once the task has finished."""
+
+        granted = threading.Event()
+        request = (
+            -self.app_estimates.get(app_name, 0),
+            -input_size(inputs),
+            next(self.sequence),
+            granted,
+        )
+        with self.lock:
+            heapq.heappush(self.queues.setdefault(app_name, []), request)
+            self.dispatch()
+        if not granted.is_set():
+            logging.debug(f"Waiting for free submission slot for '{app_name}'")
+            granted.wait()
+
+    def release(self, app_name):
+        with self.lock:
+            self.in_flight[app_name] -= 1
+            self.total_in_flight -= 1
+            self.dispatch()
+
+    def dispatch(self):
+        """Grants free slots to waiting requests, longest estimated work
+        first. Must be called with lock held."""
+
+        while not self.max_in_flight or self.total_in_flight < self.max_in_flight:
+            heads = [
+                (queue[0], app_name)
+                for app_name, queue in self.queues.items()
+                if queue and self.app_has_slot(app_name)
+            ]
+            if not heads:
+                return
+            _, app_name = min(heads)
+            request = heapq.heappop(self.queues[app_name])
+            self.in_flight[app_name] = self.in_flight.get(app_name, 0) + 1
+            self.total_in_flight += 1
+            request[-1].set()
+
+    def app_has_slot(self, app_name):
+        limit = self.app_limits.get(app_name)
+        return not limit or self.in_flight.get(app_name, 0) < limit
+
+
+def input_size(inputs):
+    "Returns total size in bytes of all files in task inputs"
+
+    size = 0
+    for value in inputs.values():
+        for item in value if isinstance(value, list) else [value]:
+            item_size = getattr(item, "size", None)
+            if isinstance(item_size, int):
+                size += item_size
+    return size
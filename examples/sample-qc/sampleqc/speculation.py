@@ -0,0 +1,115 @@
+"""
+Registry of tasks that are started speculatively, i.e. before it is known
+whether their result will be needed. Tasks are registered by task name,
+so that the step deciding about the result can cancel them without holding
+a reference to the task. Cancelled tasks are aborted on the platform, or
+not started at all if cancelled early enough. At the end of the run, the
+latency saved by speculative tasks that were needed is reported, along with
+the platform run time of tasks that turned out not to be needed, whether
+they were aborted or had already finished when cancelled.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from freyja.graph import Singleton
+from sampleqc.tracing import timestamp
+
+
+class Speculation(metaclass=Singleton):
+    "Speculative tasks by name, with statistics for the final report"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.submitted = {}  # task name -> submission time
+        self.finished = {}  # task name -> finishing time
+        self.running = {}  # task name -> task
+        self.finished_tasks = {}  # task name -> finished task
+        self.cancelled = set()
+        self.saved = []  # latency saved per needed task [s]
+        self.unneeded = []  # platform run time per task not needed [s]
+        atexit.register(self.report)
+
+    def is_cancelled(self, task_name):
+        with self.lock:
+            return task_name in self.cancelled
+
+    def start(self, task_name, task):
+        """Registers task that has just been submitted. Returns false if
+        task was cancelled in the meantime, in which case it is aborted."""
+
+        with self.lock:
+            self.submitted[task_name] = time.time()
+            if task_name not in self.cancelled:
+                self.running[task_name] = task
+                return True
+        self.abort(task_name, task)
+        return False
+
+    def finish(self, task_name, task):
+        with self.lock:
+            self.finished[task_name] = time.time()
+            self.finished_tasks[task_name] = task
+            self.running.pop(task_name, None)
+
+    def cancel(self, task_name):
+        """Marks task as not needed. Aborts it if it is running, otherwise
+        prevents it from being started."""
+
+        with self.lock:
+            self.cancelled.add(task_name)
+            task = self.running.pop(task_name, None)
+            finished_task = self.finished_tasks.get(task_name)
+            if finished_task:
+                self.unneeded.append(run_time(finished_task))
+        if task:
+            self.abort(task_name, task)
+        logging.info(f"Cancelled speculative task '{task_name}'")
+
+    def abort(self, task_name, task):
+        try:
+            task.abort()
+            task.reload()  # for start time of task
+        except Exception as e:
+            logging.warning(f"Could not abort task '{task.name}': {e}")
+
+        with self.lock:
+            self.unneeded.append(run_time(task))
+
+    def confirm(self, task_name):
+        """Marks task as needed. Without speculation, it would have been
+        started only now, so the time it has been running up to now (or
+        up to its end, if already finished) is saved."""
+
+        now = time.time()
+        with self.lock:
+            if task_name not in self.submitted:
+                return  # re-used from earlier run or not submitted yet
+            end = min(now, self.finished.get(task_name, now))
+            self.saved.append(end - self.submitted[task_name])
+
+    def report(self):
+        if not self.saved and not self.unneeded:
+            return
+        logging.info(
+            "Speculative execution: %d tasks needed, %.0f s latency saved; "
+            "%d tasks not needed, %.0f s platform run time spent on them"
+            % (
+                len(self.saved),
+                sum(self.saved),
+                len(self.unneeded),
+                sum(self.unneeded),
+            )
+        )
+
+
+def run_time(task):
+    """Returns time task has been running on platform, from start time up
+    to end time or up to now, or 0 if it never started"""
+
+    started = timestamp(getattr(task, "start_time", None))
+    if started is None:
+        return 0.0
+    ended = timestamp(getattr(task, "end_time", None)) or time.time()
+    return max(0.0, ended - started)
@@ -1,58 +1,108 @@
+import logging
+import os
 import tempfile
 from freyja import Input, Output, Step, List
-from hephaestus import File, UploadFile
+from hephaestus import File
+from sampleqc import cache
 from sampleqc.context import Context
+from sampleqc.qcmetrics import QCMetricsTable
+from sampleqc.summary import (
+    SUMMARY_FILE_NAME,
+    StreamingQCSummary,
+    header_line,
+    summary_line,
+    upload_if_changed,
+)
+from sampleqc.tracing import Tracer, traced
 from sampleqc.types import ProcessedBam
-from sampleqc.utils import bam_qc_metrics_ok
+from sampleqc.utils import hydrate_files
 
 
 class CollectAndUploadQCSummary(Step):
     """Collects BAM QC metrics from all processed samples and uploads
     summary file in tab-separated format to SB project. Overwrites 
-    existing file. Returns uploaded file object."""
+    existing file unless it has the same content. Returns uploaded file
+    object. In streaming mode, rows have already been written by
+    AppendToQCSummary and only the final upload is left."""
 
     processed_bams = Input(List[ProcessedBam])
     uploaded_file = Output(File)
 
+    @traced
     def execute(self):
 
-        # NOTE: don't create a transient temporary file (not thread safe)
-        # because actual upload happens in another thread
-        temp_filename = tempfile.gettempdir() + "/bam_qc_metrics.tsv"
-        temp = open(temp_filename, "wt")
-
-        # write header
-        temp.write(
-            "\t".join(
-                [
-                    "sample_id",
-                    "bam_file",
-                    "pct_pf_reads_aligned",
-                    "strand_balance",
-                    "status",
-                ]
+        # waits for all samples to finish processing
+        with Tracer().span(self.name_, "graph wait: processed samples"):
+            processed_bams = list(self.processed_bams)
+
+        bam_files = hydrate_files(pb.bam_file for pb in processed_bams)
+        self.store_qc_metrics(processed_bams, bam_files)
+
+        if self.config_.qc_summary.streaming:
+            summary_path = StreamingQCSummary().finish()
+        else:
+            summary_path = self.write_summary(processed_bams, bam_files)
+
+        with Tracer().span(self.name_, "upload"):
+            self.uploaded_file = Tracer().wait_for(
+                upload_if_changed(summary_path, Context().project)
             )
-            + "\n"
+
+        if self.config_.qc_summary.streaming:
+            # local summary file can only be removed once upload is done
+            self.uploaded_file.id
+            StreamingQCSummary().remove()
+
+    def store_qc_metrics(self, processed_bams, bam_files):
+        """Stores QC metrics of all samples in local columnar table, so that
+        QC cutoffs can be re-evaluated later without re-running automation,
+        see sampleqc.qcmetrics. Logs QC results and outliers."""
+
+        table = QCMetricsTable.from_metrics(
+            [f.metadata["sample_id"] for f in bam_files],
+            [pb.qc_metrics for pb in processed_bams],
         )
+        path = os.path.join(
+            cache.cache_dir("qc_metrics"),
+            Context().project.id.replace("/", "_") + ".npz",
+        )
+        table.save(path)
 
-        # write content
-        for pb in self.processed_bams:
-            metrics_ok = bam_qc_metrics_ok(pb.qc_metrics, self.config_)
-            temp.write(
-                "\t".join(
-                    [
-                        pb.bam_file.metadata["sample_id"],
-                        pb.bam_file.name,
-                        str(pb.qc_metrics.pct_pf_reads_aligned),
-                        str(pb.qc_metrics.strand_balance),
-                        "PASS" if metrics_ok else "FAIL"
-                    ]
-                )
-                + "\n"
-            )
-        temp.close()
+        qc = self.config_.qc
+        passed = table.passes(qc.min_pct_pf_reads_aligned, qc.min_strand_balance)
+        logging.info(
+            f"{passed.sum()} of {len(table)} samples passed QC, "
+            f"metrics stored in '{path}'"
+        )
+        for sample_id, names in table.outlier_samples().items():
+            logging.info(f"  Outlier sample {sample_id}: {', '.join(names)}")
+
+    def write_summary(self, processed_bams, bam_files):
+        "Writes summary file with one row per sample, returns its path"
+
+        # NOTE: don't create a transient temporary file (not thread safe)
+        # because actual upload happens in another thread
+        temp_filename = os.path.join(tempfile.gettempdir(), SUMMARY_FILE_NAME)
+        with open(temp_filename, "wt") as temp:
+            temp.write(header_line())
+            for pb, bam_file in zip(processed_bams, bam_files):
+                temp.write(summary_line(pb, bam_file, self.config_))
+        return temp_filename
+
+
+class AppendToQCSummary(Step):
+    """Appends QC metrics of processed sample to streaming QC summary as
+    soon as sample is done. Returns processed BAM unchanged, so that
+    consumers can wait for the row to be written."""
+
+    processed_bam = Input(ProcessedBam)
+    appended_bam = Output(ProcessedBam)
+
+    @traced
+    def execute(self):
+        with Tracer().span(self.name_, "graph wait: processed sample"):
+            processed_bam = self.processed_bam
+            bam_file = processed_bam.bam_file
 
-        # upload file to platform (overwrites existing file)
-        self.uploaded_file = UploadFile(
-            local_path=temp.name, to_project=Context().project, overwrite=True
-        ).file
+        StreamingQCSummary().append(processed_bam, bam_file, self.config_)
+        self.appended_bam = processed_bam
@@ -0,0 +1,139 @@
+"""
+Writing and uploading of the QC summary file. The summary can be written
+at once when all samples are done, or streamed: rows are appended as
+samples finish, and partial summaries are uploaded periodically so that
+QC results show up in the project early. Uploads are skipped if a file
+with the same content is already in the project, which is recognized by
+content hash stored in file metadata.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from freyja.graph import Singleton
+from hephaestus import SBApi, SetMetadataBulk, UploadFile
+from sampleqc.context import Context
+from sampleqc.utils import bam_qc_metrics_ok
+
+SUMMARY_FILE_NAME = "bam_qc_metrics.tsv"
+SUMMARY_COLUMNS = [
+    "sample_id",
+    "bam_file",
+    "pct_pf_reads_aligned",
+    "strand_balance",
+    "status",
+]
+
+
+def header_line():
+    return "\t".join(SUMMARY_COLUMNS) + "\n"
+
+
+def summary_line(processed_bam, bam_file, config):
+    """Returns summary row of processed BAM. 'bam_file' is the BAM
+    file with attributes loaded, see hydrate_files()."""
+
+    metrics_ok = bam_qc_metrics_ok(processed_bam.qc_metrics, config)
+    return (
+        "\t".join(
+            [
+                bam_file.metadata["sample_id"],
+                bam_file.name,
+                str(processed_bam.qc_metrics.pct_pf_reads_aligned),
+                str(processed_bam.qc_metrics.strand_balance),
+                "PASS" if metrics_ok else "FAIL",
+            ]
+        )
+        + "\n"
+    )
+
+
+def upload_if_changed(local_path, project):
+    """Uploads file to project root, overwriting existing file with same
+    name, unless that file already has the same content. Returns file in
+    project. Content hash is kept in file metadata for later comparison."""
+
+    with open(local_path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+
+    name = os.path.basename(local_path)
+    for existing in SBApi().files.query(project=project, names=[name]).all():
+        if (existing.metadata or {}).get("content_sha1") == digest:
+            logging.info(f"'{name}' in project is up to date, skipped upload")
+            return existing
+
+    uploaded = UploadFile(local_path=local_path, to_project=project, overwrite=True)
+    return SetMetadataBulk(
+        to_files=[uploaded.file], metadata=[{"content_sha1": digest}], keep_old=True
+    ).updated_files[0]
+
+
+class StreamingQCSummary(metaclass=Singleton):
+    """Summary file that grows by one row per sample as samples finish.
+    A partial summary is uploaded at most every 'upload_interval' seconds.
+    Partial uploads run on a copy of the file in a temporary directory
+    that is removed after upload, so that appending continues during
+    upload."""
+
+    def __init__(self):
+        self.upload_interval = Context().config.qc_summary.upload_interval
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, SUMMARY_FILE_NAME)
+        self.lock = threading.Lock()
+        self.upload_lock = threading.Lock()
+        self.last_upload = time.time()
+        self.num_rows = 0
+        self.finished = False
+        with open(self.path, "wt") as f:
+            f.write(header_line())
+
+    def append(self, processed_bam, bam_file, config):
+        with self.lock:
+            with open(self.path, "at") as f:
+                f.write(summary_line(processed_bam, bam_file, config))
+            self.num_rows += 1
+            upload_due = (
+                not self.finished
+                and time.time() - self.last_upload >= self.upload_interval
+            )
+            if upload_due:
+                self.last_upload = time.time()
+
+        # skip partial upload if previous one is still running
+        if not upload_due or not self.upload_lock.acquire(blocking=False):
+            return
+        try:
+            if self.finished:
+                return
+            with tempfile.TemporaryDirectory() as temp_dir:
+                snapshot, num_rows = self.snapshot(temp_dir)
+                logging.info(f"Uploading partial QC summary ({num_rows} samples)")
+                upload_if_changed(snapshot, Context().project).id
+        finally:
+            self.upload_lock.release()
+
+    def snapshot(self, directory):
+        """Copies summary to file with same name in given directory. Returns
+        its path and number of rows."""
+
+        path = os.path.join(directory, SUMMARY_FILE_NAME)
+        with self.lock:
+            shutil.copyfile(self.path, path)
+            return path, self.num_rows
+
+    def finish(self):
+        """Waits for running partial upload and prevents further partial
+        uploads. Returns path of complete summary file, which stays in
+        place until remove() is called."""
+
+        with self.upload_lock:
+            self.finished = True
+        return self.path
+
+    def remove(self):
+        "Removes complete summary file once it has been uploaded"
+        shutil.rmtree(self.dir, ignore_errors=True)
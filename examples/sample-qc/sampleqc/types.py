@@ -6,13 +6,18 @@ must implement a serialize and deserialize method.
 
 from freyja import Type
 from hephaestus import File
+from sampleqc.qcmetrics import EXTRA_METRIC_FIELDS
 
 
 class BamQCMetrics(Type):
+    """Alignment QC metrics. Metrics used by QC cutoffs are required,
+    additional Picard metrics (see EXTRA_METRIC_FIELDS) are optional."""
 
-    def __init__(self, pct_pf_reads_aligned, strand_balance):
+    def __init__(self, pct_pf_reads_aligned, strand_balance, **extra_metrics):
         self.pct_pf_reads_aligned = pct_pf_reads_aligned
         self.strand_balance = strand_balance
+        for name in EXTRA_METRIC_FIELDS:
+            setattr(self, name, extra_metrics.get(name))
 
     @classmethod
     def init(cls, val):
@@ -20,16 +25,21 @@ class BamQCMetrics(Type):
     
     @classmethod
     def _serialize(cls, val):
-        return {
+        serialized = {
             "pct_pf_reads_aligned": val.pct_pf_reads_aligned,
             "strand_balance": val.strand_balance
         }
+        for name in EXTRA_METRIC_FIELDS:
+            if getattr(val, name, None) is not None:
+                serialized[name] = getattr(val, name)
+        return serialized
 
     @classmethod
     def _deserialize(cls, val):
         return BamQCMetrics(
             pct_pf_reads_aligned=float(val["pct_pf_reads_aligned"]), 
-            strand_balance=float(val["strand_balance"])
+            strand_balance=float(val["strand_balance"]),
+            **{k: float(val[k]) for k in EXTRA_METRIC_FIELDS if k in val}
         )
 
 class ProcessedBam(Type):
@@ -1,8 +1,45 @@
+from hephaestus import SBApi
+
+BULK_SIZE = 100  # max number of files per bulk request
+
+
 def bam_qc_metrics_ok(qc_metrics, config):
     """Returns true if alignment metrics pass quality cutoffs
-    that are defined in config file"""
+    that are defined in config file. For many samples at once,
+    see QCMetricsTable.passes()."""
 
     return (
         qc_metrics.pct_pf_reads_aligned >= config.qc.min_pct_pf_reads_aligned
         and abs(qc_metrics.strand_balance) >= config.qc.min_strand_balance
     )
+
+
+def metadata_up_to_date(file, metadata, keep_old=True):
+    """Returns true if file already has given metadata, in which case
+    there is no need to update it. Values are compared as strings. With
+    'keep_old', metadata fields not given are ignored, otherwise file
+    must not have any other metadata fields."""
+
+    existing = file.metadata or {}
+    if not keep_old and set(existing) != set(metadata):
+        return False
+
+    return all(str(existing.get(k)) == str(v) for k, v in metadata.items())
+
+
+def hydrate_files(files):
+    """Returns files with all attributes loaded, such as size and metadata.
+    Files passed between steps are loaded lazily, i.e. with one request per
+    file on first attribute access. Instead, files are fetched here with one
+    bulk request per 100 files. Files that could not be fetched are returned
+    as given."""
+
+    files = list(files)
+    hydrated = []
+    for i in range(0, len(files), BULK_SIZE):
+        batch = files[i : i + BULK_SIZE]
+        records = SBApi().files.bulk_get(files=batch)
+        hydrated.extend(
+            r.resource if r.valid else f for f, r in zip(batch, records)
+        )
+    return hydrated
@@ -3,8 +3,10 @@ from freyja import Automation, Step, Input, Output, List, Optional, Enum
 from hephaestus import FindOrImportFiles, SetMetadataBulk, ExportFiles, SBApi
 from hephaestus.types import File, VolumeFolder, Project
 from app.context import Context
+from app.utils import metadata_up_to_date
 from app.types import Sample, Case, Cohort
 from app.apps import BAMprep, WESsomatic, MultiQC
+from app.tracing import Tracer, traced
 
 
 class Coverage(Enum):
@@ -64,6 +66,7 @@ class Main(Step):
         description="MuTect somatic variants calls for BAM fails that passed QC.",
     )
 
+    @traced(container=True)
     def execute(self):
         "Execution starts here."
 
@@ -97,9 +100,11 @@ class Main(Step):
 
         cohort.vcfs = []
         for case in cohort.cases:
-            if self.passes_qc(case.tumor_sample) and self.passes_qc(
-                case.normal_sample
-            ):
+            with Tracer().span(self.name_, "graph wait: BAMprep QC"):
+                passed = self.passes_qc(
+                    case.tumor_sample
+                ) and self.passes_qc(case.normal_sample)
+            if passed:
                 case.wes = WESsomatic(
                     f"WESsomatic-{case.case_id}",
                     case_id=case.case_id,
@@ -168,6 +173,7 @@ class ImportFilesAndGroupIntoCohort(Step):
     src_dir = Input(VolumeFolder)
     cohort = Output(Cohort)
 
+    @traced
     def execute(self):
         imported_files = self.import_files_from_volume()
         updated_files = self.update_file_metadata(imported_files)
@@ -195,15 +201,43 @@ class ImportFilesAndGroupIntoCohort(Step):
     def update_file_metadata(self, files):
         """Sets file metadata in bulk for list of files based on file names.
         Setting metadata in bulk instead of per-file reduces API calls.
+        If 'skip_unchanged_metadata' is set in config, files that already
+        have the desired metadata (e.g. during re-runs) are not updated.
         Example filename: TCRBOA7-N-WEX-TEST.read1.fastq"""
 
-        metadata = []
+        skip_unchanged = self.config_.skip_unchanged_metadata
+
+        unchanged_files, files_to_update, metadata = [], [], []
         for file in files:
             sample_id = file.name.split("-WEX")[0]
             paired_end = file.name.split("read")[1].split(".")[0]
-            metadata.append({"sample_id": sample_id, "paired_end": paired_end})
+            record = {"sample_id": sample_id, "paired_end": paired_end}
+
+            if skip_unchanged and metadata_up_to_date(
+                file, record, keep_old=False
+            ):
+                unchanged_files.append(file)
+            else:
+                files_to_update.append(file)
+                metadata.append(record)
 
-        return SetMetadataBulk(to_files=files, metadata=metadata).updated_files
+        if skip_unchanged:
+            logging.info(
+                f"Metadata already up to date for {len(unchanged_files)} of "
+                f"{len(files)} files, skipped these metadata writes."
+            )
+        if not files_to_update:
+            return unchanged_files
+
+        updated_files = SetMetadataBulk(
+            to_files=files_to_update, metadata=metadata
+        ).updated_files
+
+        # keep input order, e.g. read 1 before read 2, so that task inputs
+        # and thereby re-used tasks do not depend on which files were
+        # updated
+        updated_files = {f.id: f for f in updated_files}
+        return [updated_files.get(f.id, f) for f in files]
 
     def group_files_by_sample(self, files):
         """Groups files into list of sample objects for easier downstream
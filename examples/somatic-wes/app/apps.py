@@ -1,32 +1,112 @@
 import datetime
 import logging
+import time
 from freyja import Input, Output, Step, List, Optional
-from hephaestus import FindOrCreateAndRunTask, File, Task
+from hephaestus import FindOrCreateAndRunTask, File, SBApi, Task
 from app.context import Context
+from app.picard import read_metrics_row
+from app.polling import FINAL_STATUSES, TaskPoller
+from app.scheduler import SubmissionScheduler
+from app.taskindex import ProjectTasks, TaskIndex, task_key
+from app.tracing import Tracer, traced
 
 
 class AppStep(Step):
     """Base class for all steps executing apps on the SB platform.
-    Finished task is return on 'task' output."""
+    Finished task is return on 'task' output. Phases of task execution
+    are recorded in trace if tracing is enabled."""
 
     task = Output(Task)
 
     def run_task(self, app_name, inputs, task_name=None):
         """Executes app on SB platform and returns finished task.
-        'app_name' must have defined app in automation config file."""
+        'app_name' must have defined app in automation config file.
+        Tasks that ran the same app revision on the same inputs before
+        are found in local task index first; only on a miss is the
+        platform queried for a matching task or a new task created."""
 
         ctx = Context()
+        tracer = Tracer()
         if not task_name:
             task_name = self.name_
 
-        self.task = FindOrCreateAndRunTask(
-            new_name=task_name
+        index = TaskIndex()
+        with tracer.span(self.name_, "task index lookup"):
+            key = task_key(ctx.project, ctx.apps[app_name], inputs)
+            task = index.find_task(key)
+        if task:
+            logging.info(f"Re-using task '{task.name}' from local task index")
+            self.task = task
+            return
+
+        new_name = (
+            task_name
             + " - "
-            + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            inputs=inputs,
+            + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        )
+        # number of tasks in flight is bounded per app and overall
+        scheduler = SubmissionScheduler()
+        with tracer.span(self.name_, "submission slot wait", app=app_name):
+            scheduler.acquire(app_name, inputs)
+
+        submitted = time.time()
+        try:
+            with tracer.span(self.name_, "run task", app=app_name):
+                if ctx.config.task_polling.bulk:
+                    task = self.create_and_run_task(
+                        new_name, app_name, inputs
+                    )
+                else:
+                    task = FindOrCreateAndRunTask(
+                        new_name=new_name,
+                        inputs=inputs,
+                        app=ctx.apps[app_name],
+                        in_project=ctx.project,
+                    ).finished_task
+                    # wait for task, so that submission slot is held until
+                    # it has finished
+                    task.id
+        finally:
+            scheduler.release(app_name)
+
+        tracer.add_task_phases(self.name_, task, since=submitted)
+        with tracer.span(self.name_, "output fetch"):
+            task.outputs
+
+        index.record(key, task.id)
+        self.task = task
+
+    def create_and_run_task(self, name, app_name, inputs):
+        """Finds or creates and runs task, then waits for it to finish
+        using the shared task poller. Like FindOrCreateAndRunTask, re-uses
+        matching task in project if there is one, see ProjectTasks."""
+
+        task = self.find_or_create_task(name, app_name, inputs)
+        if task.status not in FINAL_STATUSES:
+            task = TaskPoller().wait(task, app_name)
+
+        if task.status != "COMPLETED":
+            raise Exception(
+                f"Task '{task.name}' finished with status {task.status}"
+            )
+        return task
+
+    def find_or_create_task(self, name, app_name, inputs):
+        "Returns matching task in project, or newly created and started task"
+
+        ctx = Context()
+        task = ProjectTasks().find(ctx.project, ctx.apps[app_name], inputs)
+        if task:
+            logging.info(f"Re-using task '{task.name}' found in project")
+            return task
+
+        return SBApi().tasks.create(
+            name=name,
+            project=ctx.project,
             app=ctx.apps[app_name],
-            in_project=ctx.project,
-        ).finished_task
+            inputs=inputs,
+            run=True,
+        )
 
 
 class BAMprep(AppStep):
@@ -41,6 +121,7 @@ class BAMprep(AppStep):
     output_bam = Output(File)
     median_target_coverage = Output(int)
 
+    @traced
     def execute(self):
         ctx = Context()
         self.run_task(
@@ -70,9 +151,11 @@ class BAMprep(AppStep):
     def get_median_target_coverage(self, file):
         "Parses median target coverage from hs metrics file"
 
-        for line in file.content().split("\n"):
-            if line.startswith("SureSelect"):
-                return int(line.strip().split("\t")[23])
+        with Tracer().span(self.name_, "metrics parsing"):
+            row = read_metrics_row(
+                file, "BAIT_SET", "SureSelect", prefix=True
+            )
+        return int(float(row["MEDIAN_TARGET_COVERAGE"]))
 
 
 class WESsomatic(AppStep):
@@ -82,6 +165,7 @@ class WESsomatic(AppStep):
 
     annotated_mutect_variants = Output(File)
 
+    @traced
     def execute(self):
         ctx = Context()
         self.run_task(
@@ -117,6 +201,7 @@ class MultiQC(AppStep):
     html_report = Output(File)
     pdf_report = Output(File)
 
+    @traced
     def execute(self):
         ctx = Context()
         self.run_task(
@@ -0,0 +1,58 @@
+"""
+Per-user local cache for data that is expensive to fetch from the
+platform or to compute, such as parsed metrics files. Entries are
+pickled into files named after a hash of their key, below the
+directory configured as 'local_cache_dir' in the config file. Entries
+that cannot be unpickled, e.g. after classes changed, count as misses.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+from app.context import Context
+
+# part of every key, increase when layout of cached objects changes
+CACHE_VERSION = 2
+
+
+def cache_dir(kind):
+    "Returns cache directory for given kind of entries, creates it if needed"
+
+    root = os.path.expanduser(Context().config.local_cache_dir)
+    path = os.path.join(root, kind)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_path(kind, key):
+    key = repr((CACHE_VERSION, key))
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(kind), digest + ".pickle")
+
+
+def load(kind, key):
+    "Returns cached object for key, or None if not cached"
+
+    try:
+        with open(cache_path(kind, key), "rb") as f:
+            return pickle.load(f)
+    except (
+        OSError,
+        EOFError,
+        pickle.UnpicklingError,
+        AttributeError,
+        TypeError,
+        ImportError,
+    ):
+        return None
+
+
+def store(kind, key, obj):
+    "Caches object for key. Writes atomically, safe for concurrent runs."
+
+    path = cache_path(kind, key)
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, path)
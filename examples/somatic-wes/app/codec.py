@@ -0,0 +1,186 @@
+"""
+Compact binary encoding for serialized values of custom types, i.e. for
+nested structures of dicts, lists, strings, numbers, booleans and None.
+Lists are decoded lazily: each list item is encoded separately, with an
+offset table in front, and items are decoded on first access. Items that
+were never accessed are copied over as encoded bytes when the value is
+serialized again, so passing a large cohort from step to step does not
+decode and re-encode cases that a step does not look at.
+
+Only dicts and lists on the path from the top-level value down to the
+outermost lists are framed; list items themselves are encoded as JSON,
+which keeps encoding and decoding of items fast. The encoded form is a
+dict holding the zlib-compressed encoding as base64 text, so that it can
+be stored wherever JSON can.
+"""
+
+import base64
+import json
+import struct
+import zlib
+from collections.abc import Sequence
+
+COMPACT_KEY = "compact"
+
+JSON, DICT, LIST = b"J", b"D", b"L"
+UINT = struct.Struct("<I")
+
+
+def dumps(value):
+    "Returns compact form of JSON-like value"
+
+    data = zlib.compress(b"".join(encode(value)), 1)
+    return {COMPACT_KEY: base64.b64encode(data).decode("ascii")}
+
+
+def loads(compact):
+    "Decodes compact form, outermost lists are returned as LazyList"
+
+    data = zlib.decompress(base64.b64decode(compact[COMPACT_KEY]))
+    value, _ = decode(data, 0)
+    return value
+
+
+def is_compact(val):
+    return isinstance(val, dict) and COMPACT_KEY in val
+
+
+def encode(value):
+    "Returns encoding of value as list of byte strings"
+
+    if isinstance(value, (list, tuple, LazyList)):
+        if isinstance(value, LazyList):
+            items = value.encoded_items()
+        else:
+            items = [to_json(item) for item in value]
+        offsets, offset = [0], 0
+        for item in items:
+            offset += len(item)
+            offsets.append(offset)
+        header = struct.pack(f"<{len(offsets) + 1}I", len(items), *offsets)
+        return [LIST, header] + items
+
+    if isinstance(value, dict) and any(
+        isinstance(v, (dict, list, tuple, LazyList)) for v in value.values()
+    ):
+        parts = [DICT, UINT.pack(len(value))]
+        for key, item in value.items():
+            key = key.encode("utf-8")
+            item = encode(item)
+            parts += [UINT.pack(len(key)), key]
+            parts += [UINT.pack(sum(len(p) for p in item))] + item
+        return parts
+
+    data = to_json(value)
+    return [JSON, UINT.pack(len(data)), data]
+
+
+def decode(data, pos):
+    "Decodes value starting at position, returns value and end position"
+
+    tag = data[pos : pos + 1]
+    pos += 1
+    if tag == JSON:
+        (size,) = UINT.unpack_from(data, pos)
+        pos += UINT.size
+        return json.loads(data[pos : pos + size]), pos + size
+    if tag == DICT:
+        (count,) = UINT.unpack_from(data, pos)
+        pos += UINT.size
+        value = {}
+        for _ in range(count):
+            (size,) = UINT.unpack_from(data, pos)
+            pos += UINT.size
+            key = data[pos : pos + size].decode("utf-8")
+            pos += size
+            (size,) = UINT.unpack_from(data, pos)
+            pos += UINT.size
+            value[key], _ = decode(data, pos)
+            pos += size
+        return value, pos
+    if tag == LIST:
+        items = LazyList(data, pos)
+        return items, items.end
+    raise Exception(f"Invalid tag {tag} in encoded data")
+
+
+def to_json(value):
+    return json.dumps(value, separators=(",", ":"), default=plain).encode(
+        "utf-8"
+    )
+
+
+def plain(value):
+    "Converts lazy lists nested in list items when encoding items as JSON"
+
+    if isinstance(value, LazyList):
+        return list(value.plain_items())
+    raise TypeError(f"Cannot encode value of type {type(value).__name__}")
+
+
+class LazyList(Sequence):
+    """Read-only list decoded on access. Items are decoded and converted
+    when first accessed. 'convert' turns decoded items into objects, e.g.
+    custom types, and 'serialize' turns them back when the list is encoded
+    again."""
+
+    def __init__(self, data, pos, convert=None, serialize=None):
+        self.data = data
+        self.pos = pos
+        self.convert = convert
+        self.serialize = serialize
+        (self.count,) = UINT.unpack_from(data, pos)
+        self.offsets = struct.unpack_from(
+            f"<{self.count + 1}I", data, pos + UINT.size
+        )
+        self.items_pos = pos + UINT.size * (self.count + 2)
+        self.end = self.items_pos + self.offsets[-1]
+        self.items = {}  # index -> decoded item
+
+    def typed(self, convert, serialize):
+        "Returns view of same encoded list with conversion of items"
+        return LazyList(self.data, self.pos, convert, serialize)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("list index out of range")
+        if index not in self.items:
+            item = json.loads(self.encoded_item(index))
+            self.items[index] = self.convert(item) if self.convert else item
+        return self.items[index]
+
+    def encoded_item(self, index):
+        start = self.items_pos + self.offsets[index]
+        return self.data[start : self.items_pos + self.offsets[index + 1]]
+
+    def encoded_items(self):
+        """Returns encoded items: items never accessed are passed on as they
+        are, accessed items are serialized again because they may have
+        changed"""
+
+        return [
+            to_json(self.plain_item(i))
+            if i in self.items
+            else self.encoded_item(i)
+            for i in range(self.count)
+        ]
+
+    def plain_items(self):
+        "Yields items in serialized form"
+
+        for i in range(self.count):
+            if i in self.items:
+                yield self.plain_item(i)
+            else:
+                yield json.loads(self.encoded_item(i))
+
+    def plain_item(self, index):
+        item = self.items[index]
+        return self.serialize(item) if self.serialize else item
@@ -0,0 +1,70 @@
+"""
+Streaming parser for metrics files written by Picard tools. Only the
+header block and the metrics table are read; the download stops right
+after the table, so histograms that may follow are never transferred.
+Columns are looked up by name. Parsed metrics are cached locally by
+file ID, so that re-runs and repeated QC checks don't download
+metrics files again.
+"""
+
+from app import cache
+
+STREAM_PART_SIZE = 64 * 1024
+
+
+def read_metrics(file):
+    """Returns rows of metrics table in Picard metrics file as list
+    of dicts keyed by column name. Values are returned as strings."""
+
+    rows = cache.load("picard", file.id)
+    if rows is None:
+        rows = parse_metrics(stream_lines(file))
+        cache.store("picard", file.id, rows)
+    return rows
+
+
+def read_metrics_row(file, column, value, prefix=False):
+    """Returns first row of metrics table with given value in column,
+    or with column value starting with given value if 'prefix' is set"""
+
+    for row in read_metrics(file):
+        if row[column] == value or (prefix and row[column].startswith(value)):
+            return row
+    raise Exception(f"No {column} '{value}' found in metrics file {file.name}")
+
+
+def parse_metrics(lines):
+    """Parses metrics table from lines of Picard metrics file. Comment
+    lines starting with '#' and empty lines before the table are skipped,
+    first line after that is the header. Stops consuming lines at the
+    first empty or comment line after the table."""
+
+    header, rows = None, []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.strip() or line.startswith("#"):
+            if header:
+                break
+            continue
+
+        values = line.split("\t")
+        if header is None:
+            header = values
+        else:
+            values += [""] * (len(header) - len(values))
+            rows.append(dict(zip(header, values)))
+
+    return rows
+
+
+def stream_lines(file):
+    "Yields lines of file while it is being downloaded in parts"
+
+    buffer = b""
+    for part in file.stream(part_size=STREAM_PART_SIZE):
+        buffer += part
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8")
+    if buffer:
+        yield buffer.decode("utf-8")
@@ -0,0 +1,171 @@
+"""
+Shared poller for the status of all in-flight tasks. Instead of every
+step polling its own task, steps hand their task to the poller and wait.
+A single background thread checks all tasks that are due with batched
+status queries and wakes up waiting steps as soon as their task has
+finished. Polling intervals adapt to expected task durations, which
+are learned per app from tasks that completed during this run.
+If polling fails, or a task does not leave DRAFT status in time, waiting
+steps fail instead of waiting forever.
+"""
+
+import logging
+import threading
+import time
+from freyja.graph import Singleton
+from hephaestus import SBApi
+from app.context import Context
+
+FINAL_STATUSES = ["COMPLETED", "FAILED", "ABORTED"]
+BULK_SIZE = 100  # max number of tasks per bulk request
+SMOOTHING = 0.3  # weight of latest duration in expected duration per app
+
+
+class TaskWaiter:
+    "Task that a step is waiting for, with its polling schedule"
+
+    def __init__(self, task, app_name, period):
+        self.task = task
+        self.app_name = app_name
+        self.started = time.time()
+        self.period = period
+        self.next_check = self.started + period
+        self.finished = threading.Event()
+        self.error = None
+
+
+class TaskPoller(metaclass=Singleton):
+    """Polls status of all registered tasks in bulk. Polling thread is
+    started on demand and exits when no tasks are left."""
+
+    def __init__(self):
+        config = Context().config.task_polling
+        self.min_period = config.min_period
+        self.max_period = config.max_period
+        self.draft_timeout = config.draft_timeout
+        self.expected_durations = {}  # app name -> seconds
+        self.waiters = {}  # task ID -> TaskWaiter
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def wait(self, task, app_name):
+        """Blocks until task has finished and returns updated task.
+        'app_name' is used to learn and predict task durations."""
+
+        waiter = TaskWaiter(task, app_name, self.min_period)
+        with self.condition:
+            self.waiters[task.id] = waiter
+            if not self.thread:
+                self.thread = threading.Thread(
+                    target=self.run, name="TaskPoller", daemon=True
+                )
+                self.thread.start()
+            self.condition.notify()
+
+        waiter.finished.wait()
+        if waiter.error:
+            raise Exception(
+                f"Waiting for task '{task.name}' failed: {waiter.error}"
+            )
+        return waiter.task
+
+    def run(self):
+        """Polls until no tasks are left. If polling fails, all waiting
+        steps fail with the error, and the next wait() starts a new
+        thread."""
+
+        try:
+            self.poll_until_done()
+        except Exception as e:
+            logging.error(f"Task poller failed: {e}")
+            with self.condition:
+                failed = list(self.waiters.values())
+                self.waiters.clear()
+                self.thread = None
+            for waiter in failed:
+                waiter.error = e
+                waiter.finished.set()
+        finally:
+            with self.condition:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+
+    def poll_until_done(self):
+        while True:
+            with self.condition:
+                if not self.waiters:
+                    self.thread = None
+                    return
+                # also include tasks due soon, so that they are batched
+                # into one request rather than polled one by one
+                now = time.time()
+                horizon = now + self.min_period
+                due = [
+                    w for w in self.waiters.values() if w.next_check <= horizon
+                ]
+                if not any(w.next_check <= now for w in due):
+                    next_check = min(
+                        w.next_check for w in self.waiters.values()
+                    )
+                    self.condition.wait(timeout=next_check - now)
+                    continue
+
+            for i in range(0, len(due), BULK_SIZE):
+                self.poll(due[i : i + BULK_SIZE])
+
+    def poll(self, waiters):
+        "Gets status of tasks with one bulk request and updates waiters"
+
+        try:
+            records = SBApi().tasks.bulk_get(tasks=[w.task for w in waiters])
+        except Exception as e:
+            logging.warning(f"Bulk task status query failed, retrying: {e}")
+            records = [None] * len(waiters)
+
+        now = time.time()
+        for waiter, record in zip(waiters, records):
+            if record is not None and record.valid:
+                waiter.task = record.resource
+                if waiter.task.status in FINAL_STATUSES:
+                    self.finish(waiter, now)
+                    continue
+                if (
+                    waiter.task.status == "DRAFT"
+                    and now - waiter.started > self.draft_timeout
+                ):
+                    waiter.error = (
+                        f"still in DRAFT after {self.draft_timeout}s"
+                    )
+                    self.finish(waiter, now)
+                    continue
+            self.schedule(waiter, now)
+
+        logging.debug(
+            f"Polled {len(waiters)} tasks, {len(self.waiters)} in flight"
+        )
+
+    def schedule(self, waiter, now):
+        """Sets time of next status check. While a task is expected to be
+        running, checks at half of its expected remaining time. Without
+        an estimate, or once overdue, backs off exponentially."""
+
+        expected = self.expected_durations.get(waiter.app_name)
+        remaining = expected - (now - waiter.started) if expected else 0
+        if remaining > 0:
+            period = remaining / 2
+        else:
+            period = waiter.period * 2
+        waiter.period = min(self.max_period, max(self.min_period, period))
+        waiter.next_check = now + waiter.period
+
+    def finish(self, waiter, now):
+        if waiter.task.status == "COMPLETED":
+            duration = now - waiter.started
+            expected = self.expected_durations.get(waiter.app_name, duration)
+            self.expected_durations[waiter.app_name] = (
+                SMOOTHING * duration + (1 - SMOOTHING) * expected
+            )
+
+        with self.condition:
+            del self.waiters[waiter.task.id]
+        waiter.finished.set()
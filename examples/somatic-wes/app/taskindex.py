@@ -0,0 +1,156 @@
+"""
+Persistent local index of finished tasks, stored in a SQLite database
+in the local cache directory. Maps a hash of project, app revision and
+normalized task inputs to the ID of the task that ran the app on these
+inputs. On re-runs, tasks are found with one local lookup and a single
+API call instead of querying and comparing all tasks in the project.
+On a miss, e.g. on a fresh machine, tasks in the project are searched
+for a matching task before a new one is created, see ProjectTasks.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from freyja.graph import Singleton
+from hephaestus import SBApi
+from app import cache
+
+
+def task_key(project, app, inputs):
+    "Returns hash identifying task of app with given inputs in project"
+
+    payload = json.dumps(
+        {
+            "project": project.id,
+            "app": app.id,
+            "revision": app.revision,
+            "inputs": normalize(inputs),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def normalize(value):
+    "Converts task inputs into JSON-serializable form, files by their IDs"
+
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if hasattr(value, "id"):
+        return {"id": value.id}
+    return str(value)
+
+
+class TaskIndex(metaclass=Singleton):
+    """Local index of finished tasks by task key. Safe to use from any
+    thread, each access opens and closes its own connection."""
+
+    def __init__(self):
+        self.path = os.path.join(cache.cache_dir("tasks"), "tasks.sqlite")
+        with self.connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tasks "
+                "(key TEXT PRIMARY KEY, task_id TEXT NOT NULL, recorded REAL)"
+            )
+
+    @contextlib.contextmanager
+    def connect(self):
+        "Yields connection, commits changes and closes connection on exit"
+
+        with contextlib.closing(sqlite3.connect(self.path, timeout=60)) as db:
+            with db:
+                yield db
+
+    def lookup(self, key):
+        "Returns ID of task recorded for key, or None"
+
+        with self.connect() as db:
+            row = db.execute(
+                "SELECT task_id FROM tasks WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def record(self, key, task_id):
+        with self.connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?)",
+                (key, task_id, time.time()),
+            )
+
+    def forget(self, key):
+        with self.connect() as db:
+            db.execute("DELETE FROM tasks WHERE key = ?", (key,))
+
+    def find_task(self, key):
+        """Returns finished task recorded for key if it still exists and
+        completed successfully, otherwise removes entry and returns None"""
+
+        task_id = self.lookup(key)
+        if not task_id:
+            return None
+
+        try:
+            task = SBApi().tasks.get(id=task_id)
+        except Exception as e:
+            logging.warning(f"Indexed task {task_id} not accessible: {e}")
+            task = None
+
+        if task is None or task.status != "COMPLETED":
+            self.forget(key)
+            return None
+        return task
+
+
+class ProjectTasks(metaclass=Singleton):
+    """Tasks in execution project that can be re-used, i.e. tasks that
+    completed or are still running. Listed with one paged query on first
+    use and searched for tasks that ran the same app revision on the same
+    inputs, which is what FindOrCreateAndRunTask does for each task.
+    Matching tasks that were not completed when listed are reloaded before
+    they are re-used, as they may have failed or been aborted since."""
+
+    REUSABLE_STATUSES = ["COMPLETED", "RUNNING", "QUEUED"]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tasks = None
+
+    def find(self, project, app, inputs):
+        """Returns matching task, preferring completed tasks, or None.
+        Task inputs are only fetched for tasks of the same app."""
+
+        with self.lock:
+            if self.tasks is None:
+                self.tasks = [
+                    task
+                    for task in SBApi().tasks.query(project=project).all()
+                    if task.status in self.REUSABLE_STATUSES
+                ]
+            tasks = list(self.tasks)
+
+        expected = normalize(inputs)
+        matches = [
+            task
+            for task in tasks
+            if task.app in (app.id, f"{app.id}/{app.revision}")
+            and normalize({k: task.inputs.get(k) for k in inputs}) == expected
+        ]
+        matches.sort(key=lambda task: task.status != "COMPLETED")
+        for task in matches:
+            if task.status != "COMPLETED":
+                task.reload()
+            if task.status in self.REUSABLE_STATUSES:
+                return task
+            with self.lock:
+                if task in self.tasks:
+                    self.tasks.remove(task)
+        return None
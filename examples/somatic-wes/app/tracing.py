@@ -0,0 +1,229 @@
+"""
+Records a timeline of execution phases for every step, such as waiting
+for a task, task queueing and runtime on the platform, and metrics
+parsing. At the end of the run, the timeline is written as Chrome trace
+file that can be opened in chrome://tracing or https://ui.perfetto.dev,
+together with a text summary of the critical path through the run.
+Enabled with 'tracing' section in config file.
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+from freyja.graph import Singleton
+from app.context import Context
+
+CLOCK_SKEW = 60  # tolerated offset between local and platform clock [s]
+
+
+class Span:
+    "Phase of a step between start and end time (in seconds since epoch)"
+
+    def __init__(self, step, phase, start, end, args=None):
+        self.step = step
+        self.phase = phase
+        self.start = start
+        self.end = end
+        self.args = args or {}
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class Tracer(metaclass=Singleton):
+    "Collects spans from all threads and writes them at exit"
+
+    def __init__(self):
+        config = Context().config.tracing
+        self.enabled = config.enabled
+        self.trace_file = config.trace_file
+        self.summary_file = config.summary_file
+        self.spans = []
+        self.lock = threading.Lock()
+        if self.enabled:
+            atexit.register(self.write)
+
+    @contextlib.contextmanager
+    def span(self, step, phase, **args):
+        "Context manager recording code block as phase of step"
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(step, phase, start, time.time(), **args)
+
+    def add(self, step, phase, start, end, **args):
+        if self.enabled and start is not None and end is not None:
+            with self.lock:
+                self.spans.append(Span(step, phase, start, end, args))
+
+    def add_task_phases(self, step, task, since):
+        """Adds queueing and run time of finished platform task as phases,
+        based on task timestamps. Tasks created before 'since', i.e. re-used
+        from earlier runs, are skipped."""
+
+        created = timestamp(getattr(task, "created_time", None))
+        if created is None or created < since - CLOCK_SKEW:
+            return
+        started = timestamp(getattr(task, "start_time", None))
+        ended = timestamp(getattr(task, "end_time", None))
+        self.add(step, "task queued", created, started, task_id=task.id)
+        self.add(step, "task running", started, ended, task_id=task.id)
+
+    def write(self):
+        with open(self.trace_file, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        with open(self.summary_file, "w") as f:
+            f.write(self.critical_path_summary())
+        logging.info(
+            f"Trace written to '{self.trace_file}', "
+            f"critical path summary to '{self.summary_file}'"
+        )
+
+    def chrome_trace(self):
+        "Returns spans in Chrome trace event format, one row per step"
+
+        origin = min((s.start for s in self.spans), default=0)
+        rows, events = {}, []
+        for s in sorted(self.spans, key=lambda s: s.start):
+            if s.step not in rows:
+                rows[s.step] = len(rows) + 1
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": 1,
+                        "tid": rows[s.step],
+                        "args": {"name": s.step},
+                    }
+                )
+            events.append(
+                {
+                    "name": s.phase,
+                    "cat": s.step,
+                    "ph": "X",
+                    "pid": 1,
+                    "tid": rows[s.step],
+                    "ts": (s.start - origin) * 1e6,
+                    "dur": s.duration * 1e6,
+                    "args": s.args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def critical_path(self):
+        """Returns step executions on the critical path, from first to
+        last, as pairs of execution span and start of the step's own work,
+        see work_start(). Container steps, which instantiate other steps
+        and wait for them, are left out. Starting with the step that
+        finished last, repeatedly steps back to the step that finished last
+        before the current one started its own work. Step dependencies are
+        not recorded, so this is an approximation."""
+
+        executions = [
+            s
+            for s in self.spans
+            if s.phase == "execute" and not s.args.get("container")
+        ]
+        path = []
+        current = max(executions, key=lambda s: s.end, default=None)
+        while current:
+            start = self.work_start(current)
+            path.insert(0, (current, start))
+            current = max(
+                (
+                    s
+                    for s in executions
+                    if s.end <= start and s.end < current.end
+                ),
+                key=lambda s: s.end,
+                default=None,
+            )
+        return path
+
+    def work_start(self, execution):
+        """Returns time at which step started its own work: at the end of
+        its last graph wait, i.e. when results of other steps were
+        available, otherwise at its first recorded phase or at start of
+        execution"""
+
+        phases = [
+            s
+            for s in self.spans
+            if s.step == execution.step and s.phase != "execute"
+        ]
+        waits = [s.end for s in phases if s.phase.startswith("graph wait")]
+        if waits:
+            return max(waits)
+        return min((s.start for s in phases), default=execution.start)
+
+    def critical_path_summary(self):
+        path = self.critical_path()
+        if not path:
+            return "No steps recorded.\n"
+
+        lines = [
+            "Critical path (%.1f s):" % (path[-1][0].end - path[0][1]),
+            "%10s %10s  %s" % ("start [s]", "dur [s]", "step / phase"),
+        ]
+        origin, previous_end = path[0][1], None
+        totals = {}
+        for execution, start in path:
+            if previous_end is not None and start > previous_end:
+                wait = start - previous_end
+                totals["graph wait"] = totals.get("graph wait", 0) + wait
+                lines.append(
+                    "%10.1f %10.1f  (graph wait)"
+                    % (previous_end - origin, wait)
+                )
+            lines.append(
+                "%10.1f %10.1f  %s"
+                % (start - origin, execution.end - start, execution.step)
+            )
+            for s in self.spans:
+                if (
+                    s.step == execution.step
+                    and s.phase != "execute"
+                    and not s.phase.startswith("graph wait")
+                ):
+                    totals[s.phase] = totals.get(s.phase, 0) + s.duration
+                    lines.append(
+                        "%10.1f %10.1f    %s"
+                        % (s.start - origin, s.duration, s.phase)
+                    )
+            previous_end = execution.end
+
+        lines.append("")
+        lines.append("Time on critical path by phase:")
+        for phase, total in sorted(totals.items(), key=lambda t: -t[1]):
+            lines.append("%10.1f s  %s" % (total, phase))
+        return "\n".join(lines) + "\n"
+
+
+def timestamp(value):
+    "Converts datetime to seconds since epoch, passes None through"
+    return value.timestamp() if value else None
+
+
+def traced(execute=None, container=False):
+    """Decorator recording execute method of step as 'execute' phase. Use
+    as @traced(container=True) for steps that only instantiate other steps
+    and wait for them; these are not part of the critical path."""
+
+    if execute is None:
+        return functools.partial(traced, container=container)
+
+    args = {"container": True} if container else {}
+
+    @functools.wraps(execute)
+    def wrapper(self):
+        with Tracer().span(self.name_, "execute", **args):
+            return execute(self)
+
+    return wrapper
@@ -1,11 +1,93 @@
-from freyja import Type, List
+from freyja import Type
 from hephaestus import File
+from app import codec
+from app.context import Context
+
+# key of back-reference to file written earlier, see file_to_plain()
+FILE_REF = "file_ref"
+
+
+def serialize(to_plain, val):
+    """Serializes value into nested dicts and lists, which are encoded in
+    compact binary form if 'compact_serialization' is set in config.
+    In compact form, files are interned per item of the outermost lists,
+    see plain_list(), otherwise within the whole value."""
+
+    if Context().config.compact_serialization:
+        return codec.dumps(to_plain(val, None))
+    return to_plain(val, {})
+
+
+def deserialize(from_plain, val):
+    "Deserializes value in either plain or compact form"
+
+    if codec.is_compact(val):
+        return from_plain(codec.loads(val), None)
+    return from_plain(val, {})
+
+
+def file_to_plain(file, files):
+    """Serializes file. A file that occurs more than once in a value is
+    written in full only the first time, later occurrences are written as
+    back-reference to its ID. 'files' maps IDs of files already written
+    to files, and is shared by everything serialized in the same scope."""
+
+    if files is not None:
+        if file.id in files:
+            return {FILE_REF: file.id}
+        files[file.id] = file
+    return File._serialize(file)
+
+
+def file_from_plain(val, files):
+    """Deserializes file written by file_to_plain(). All references to a
+    file within one scope deserialize to the same object. Files are not
+    shared across values, so each value carries file attributes, such as
+    metadata and size, as they were when it was serialized."""
+
+    if isinstance(val, dict) and FILE_REF in val:
+        return files[val[FILE_REF]]
+
+    file = File._deserialize(val)
+    if files is not None:
+        files[file.id] = file
+    return file
+
+
+def plain_list(items, item_to_plain, files):
+    """Returns list of serialized items. 'files' is None for outermost
+    lists in compact form: their items are decoded lazily and in any order,
+    so each item is serialized with files of its own. Lists decoded from
+    compact form are passed on as they are, so that items not accessed
+    are not re-encoded."""
+
+    if files is None:
+        if isinstance(items, codec.LazyList):
+            return items
+        return [item_to_plain(item, {}) for item in items]
+    return [item_to_plain(item, files) for item in items]
+
+
+def typed_list(val, item_from_plain, item_to_plain, files):
+    "Returns list of deserialized items, decoded lazily if in compact form"
+
+    if isinstance(val, codec.LazyList):
+        return val.typed(
+            lambda item: item_from_plain(item, {}),
+            lambda item: item_to_plain(item, {}),
+        )
+    if files is None:
+        return [item_from_plain(item, {}) for item in val]
+    return [item_from_plain(item, files) for item in val]
 
 
 class Sample(Type):
     """Custom type representing sample with input files. Use as an example 
     to see how to create custom types that can be used as step inputs and 
-    outputs. Custom types must implement a serialize and deserialize method."""
+    outputs. Custom types must implement a serialize and deserialize method.
+
+    Deserialized from compact form, 'fastq_files' is a read-only sequence
+    that is decoded lazily; assign a new list to change it."""
 
     def __init__(self, sample_id, fastq_files=None):
         self.sample_id = sample_id
@@ -17,16 +99,26 @@ class Sample(Type):
 
     @classmethod
     def _serialize(cls, val):
+        return serialize(cls.to_plain, val)
+
+    @classmethod
+    def _deserialize(cls, val):
+        return deserialize(cls.from_plain, val)
+
+    @classmethod
+    def to_plain(cls, val, files):
         return {
             "sample_id": val.sample_id,
-            "fastq_files": List[File]._serialize(val.fastq_files),
+            "fastq_files": plain_list(val.fastq_files, file_to_plain, files),
         }
 
     @classmethod
-    def _deserialize(cls, val):
+    def from_plain(cls, val, files):
         return Sample(
             sample_id=val["sample_id"],
-            fastq_files=List[File]._deserialize(val["fastq_files"]),
+            fastq_files=typed_list(
+                val["fastq_files"], file_from_plain, file_to_plain, files
+            ),
         )
 
 
@@ -44,18 +136,26 @@ class Case(Type):
 
     @classmethod
     def _serialize(cls, val):
+        return serialize(cls.to_plain, val)
+
+    @classmethod
+    def _deserialize(cls, val):
+        return deserialize(cls.from_plain, val)
+
+    @classmethod
+    def to_plain(cls, val, files):
         return {
             "case_id": val.case_id,
-            "tumor_sample": Sample._serialize(val.tumor_sample),
-            "normal_sample": Sample._serialize(val.normal_sample),
+            "tumor_sample": Sample.to_plain(val.tumor_sample, files),
+            "normal_sample": Sample.to_plain(val.normal_sample, files),
         }
 
     @classmethod
-    def _deserialize(cls, val):
+    def from_plain(cls, val, files):
         return Case(
             case_id=val["case_id"],
-            tumor_sample=Sample._deserialize(val["tumor_sample"]),
-            normal_sample=Sample._deserialize(val["normal_sample"]),
+            tumor_sample=Sample.from_plain(val["tumor_sample"], files),
+            normal_sample=Sample.from_plain(val["normal_sample"], files),
         )
 
     @property
@@ -65,7 +165,9 @@ class Case(Type):
 
 
 class Cohort(Type):
-    """Custom type representing a set of cases"""
+    """Custom type representing a set of cases. With compact serialization,
+    cases are decoded lazily on first access, and 'cases' of a deserialized
+    cohort is a read-only sequence; assign a new list to change it."""
 
     def __init__(self, cases, name=None):
         self.cases = cases
@@ -77,12 +179,26 @@ class Cohort(Type):
 
     @classmethod
     def _serialize(cls, val):
-        return {"name": val.name, "cases": List[Case]._serialize(val.cases)}
+        return serialize(cls.to_plain, val)
 
     @classmethod
     def _deserialize(cls, val):
+        return deserialize(cls.from_plain, val)
+
+    @classmethod
+    def to_plain(cls, val, files):
+        return {
+            "name": val.name,
+            "cases": plain_list(val.cases, Case.to_plain, files),
+        }
+
+    @classmethod
+    def from_plain(cls, val, files):
         return Cohort(
-            cases=List[Case]._deserialize(val["cases"]), name=val["name"]
+            cases=typed_list(
+                val["cases"], Case.from_plain, Case.to_plain, files
+            ),
+            name=val["name"],
         )
 
     @property
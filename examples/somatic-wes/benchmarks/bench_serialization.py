@@ -0,0 +1,108 @@
+"""
+Benchmarks round trips of a Cohort through Cohort._serialize() and
+Cohort._deserialize(), in plain form (nested dicts and lists, stored as
+JSON) and in compact binary form, two FASTq files per sample. Reports
+size, time to serialize and deserialize with all cases accessed, and time
+to pass the cohort on after looking at one case only, which is where lazy
+decoding can pay off. Requires the ADK to be installed; does not make any
+platform calls. Run from inside project root directory:
+
+    python -m benchmarks.bench_serialization [--samples 10000]
+"""
+
+import argparse
+import hashlib
+import json
+import time
+import types
+import inject
+from freyja.config import Config
+from hephaestus import File
+from app.types import Case, Cohort, Sample
+
+
+def make_cohort(num_samples):
+    "Returns cohort with given number of samples"
+
+    def sample(sample_id):
+        return Sample(
+            sample_id,
+            [
+                File(id=hashlib.md5(name.encode()).hexdigest()[:24], name=name)
+                for name in [
+                    f"{sample_id}_R1.fastq.gz",
+                    f"{sample_id}_R2.fastq.gz",
+                ]
+            ],
+        )
+
+    return Cohort(
+        [
+            Case(f"C{i}", sample(f"C{i}-T"), sample(f"C{i}-N"))
+            for i in range(num_samples // 2)
+        ],
+        name="benchmark",
+    )
+
+
+def walk(cohort):
+    "Touches every file of every case, like steps processing all cases do"
+
+    return sum(len(s.fastq_files) for s in cohort.samples)
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def measure(cohort):
+    "Returns size, dump, load and pass-on time of round trip through JSON"
+
+    text, t_dump = timed(lambda: json.dumps(Cohort._serialize(cohort)))
+    _, t_load = timed(lambda: walk(Cohort._deserialize(json.loads(text))))
+
+    def pass_on():
+        decoded = Cohort._deserialize(json.loads(text))
+        decoded.cases[0].tumor_sample.fastq_files
+        return json.dumps(Cohort._serialize(decoded))
+
+    _, t_pass = timed(pass_on)
+    return len(text), t_dump, t_load, t_pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=10000)
+    args = parser.parse_args()
+
+    # types read serialization settings from context config
+    config = types.SimpleNamespace(compact_serialization=False)
+    inject.clear_and_configure(lambda binder: binder.bind(Config, config))
+
+    cohort = make_cohort(args.samples)
+
+    results = []
+    for form, compact in [("plain", False), ("compact", True)]:
+        config.compact_serialization = compact
+        results.append((form, *measure(cohort)))
+
+    print(f"{args.samples} samples")
+    print(
+        f"{'form':>8} {'size [KB]':>10} {'dump [ms]':>10}"
+        f" {'load [ms]':>10} {'pass on [ms]':>13}"
+    )
+    for form, size, dump, load, pass_ in results:
+        print(
+            f"{form:>8} {size / 1024:>10.0f} {dump * 1000:>10.1f}"
+            f" {load * 1000:>10.1f} {pass_ * 1000:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Compares wall time of per-line and batched word counting across file sizes.
+Each configuration runs the automation in a separate process, exactly as a
+user would from the command line:
+
+    python benchmark.py [--lines 1000 10000 100000] [--batch_lines 10000]
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+WORDS = "the quick brown fox jumps over the lazy dog".split()
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def write_text_file(path, num_lines, seed=42):
+    "Writes file with given number of lines of random words"
+
+    rnd = random.Random(seed)
+    with open(path, "w") as f:
+        for _ in range(num_lines):
+            f.write(" ".join(rnd.choices(WORDS, k=rnd.randint(0, 12))) + "\n")
+
+
+def run_wordcount(file_name, *args):
+    "Runs automation in subprocess and returns elapsed wall time in seconds"
+
+    cmd = [sys.executable, "wordcount.py", "run", "--file_name", file_name]
+    start = time.perf_counter()
+    subprocess.run(
+        cmd + list(args),
+        cwd=HERE,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--batch_lines", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'lines':>10} {'per-line [s]':>14} {'batched [s]':>14} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_lines in args.lines:
+            path = os.path.join(tmp, f"words-{num_lines}.txt")
+            write_text_file(path, num_lines)
+
+            per_line = run_wordcount(path)
+            batched = run_wordcount(path, "--batch_lines", str(args.batch_lines))
+            print(
+                f"{num_lines:>10} {per_line:>14.2f} {batched:>14.2f} "
+                f"{per_line / batched:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
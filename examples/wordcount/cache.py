@@ -0,0 +1,93 @@
+"""
+Persistent on-disk cache for incremental word counting. Word counts are
+stored per chunk, keyed by hash of the chunk content, and for each counted
+file the line-aligned chunks already processed are recorded, up to the last
+byte offset. Re-counting a file that only grew at the end then re-uses the
+recorded chunk boundaries, so unchanged chunks are served from the cache and
+only the appended data is counted.
+"""
+
+import json
+import os
+import tempfile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "wordcount")
+
+
+class ChunkCache:
+    """Word counts by chunk content hash plus processed chunks per file.
+    Bounded in size: least recently used chunks and files are evicted
+    when the cache is saved."""
+
+    def __init__(self, cache_dir=None, max_chunks=100000, max_files=1000):
+        self.path = os.path.join(cache_dir or DEFAULT_CACHE_DIR, "chunks.json")
+        self.max_chunks = max_chunks
+        self.max_files = max_files
+        self.clock = 0
+        self.chunks = {}  # hash -> [count, last used]
+        self.files = {}  # path -> {"chunks": [[start, end, hash]], "used": last used}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        self.clock = data["clock"]
+        self.chunks = data["chunks"]
+        self.files = data["files"]
+
+    def save(self):
+        "Evicts least recently used entries and writes cache atomically"
+
+        self.chunks = self.most_recent(self.chunks, self.max_chunks, lambda v: v[1])
+        self.files = self.most_recent(self.files, self.max_files, lambda v: v["used"])
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(
+                {"clock": self.clock, "chunks": self.chunks, "files": self.files}, f
+            )
+        os.replace(temp, self.path)
+
+    @staticmethod
+    def most_recent(entries, max_entries, last_used):
+        if len(entries) <= max_entries:
+            return entries
+        keep = sorted(entries, key=lambda k: last_used(entries[k]))[-max_entries:]
+        return {k: entries[k] for k in keep}
+
+    def tick(self):
+        self.clock += 1
+        return self.clock
+
+    def lookup(self, digest):
+        "Returns cached word count for chunk hash, None if not cached"
+
+        entry = self.chunks.get(digest)
+        if entry is None:
+            return None
+        entry[1] = self.tick()
+        return entry[0]
+
+    def store(self, digest, count):
+        self.chunks[digest] = [count, self.tick()]
+
+    def file_chunks(self, file_name, size):
+        """Returns chunks (start, end, hash) recorded for file during last
+        run, or empty list if file is unknown or has been truncated"""
+
+        record = self.files.get(os.path.abspath(file_name))
+        if not record or not record["chunks"] or record["chunks"][-1][1] > size:
+            return []
+        return [tuple(c) for c in record["chunks"]]
+
+    def set_file_chunks(self, file_name, chunks):
+        self.files[os.path.abspath(file_name)] = {
+            "chunks": [list(c) for c in chunks],
+            "used": self.tick(),
+        }
+
+    def forget_file(self, file_name):
+        self.files.pop(os.path.abspath(file_name), None)
@@ -0,0 +1,246 @@
+"""
+Word counting engine for large text files. The file is memory-mapped and
+split into byte ranges that end on line boundaries, ranges are counted in
+a process pool, and partial counts are summed up. Words are counted the
+same way as in the step-based counter, i.e. separated by any whitespace
+recognized by str.split(). Many files, e.g. all files in a directory tree,
+can be counted together in one bounded process pool.
+"""
+
+import codecs
+import glob
+import hashlib
+import logging
+import mmap
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+MIN_CHUNK_SIZE = 1 << 20  # 1 MiB
+MAX_CHUNK_SIZE = 64 << 20  # 64 MiB
+BLOCK_SIZE = 1 << 20  # bytes decoded at a time within a chunk
+PACK_SIZE = 8 << 20  # small files are packed into tasks of about this size
+
+
+def count_words(file_name, processes=None, chunk_size=None, cache=None):
+    """Returns number of words in file, counted in parallel by worker
+    processes. If a ChunkCache is given, chunks already counted during
+    earlier runs are served from the cache and only new data is counted."""
+
+    processes = processes or os.cpu_count()
+    with open(file_name, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            known = cache.file_chunks(file_name, size) if cache else []
+            offset = known[-1][1] if known else 0
+            new = split_ranges(
+                mm,
+                offset,
+                size,
+                chunk_size or default_chunk_size(size - offset, processes),
+            )
+            ranges = [(start, end) for start, end, _ in known] + new
+            line_aligned = [mm[end - 1] == ord("\n") for _, end in ranges]
+
+    parallel = processes > 1 and len(ranges) > 1
+    pool = ProcessPoolExecutor(max_workers=processes) if parallel else None
+    try:
+        if cache is None:
+            return sum(map_ranges(pool, count_range, file_name, ranges))
+
+        digests = map_ranges(pool, hash_range, file_name, ranges)
+        if [d for _, _, d in known] != digests[: len(known)]:
+            # file was modified rather than appended to, recorded chunk
+            # boundaries may no longer be line-aligned; start over
+            cache.forget_file(file_name)
+            return count_words(file_name, processes, chunk_size, cache)
+
+        counts = [cache.lookup(d) for d in digests]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        new_counts = map_ranges(
+            pool, count_range, file_name, [ranges[i] for i in missing]
+        )
+    finally:
+        if pool:
+            pool.shutdown()
+
+    for i, count in zip(missing, new_counts):
+        counts[i] = count
+        cache.store(digests[i], count)
+
+    # only record chunks up to last newline; a trailing partial
+    # line may still grow and is recounted on next run
+    recorded = []
+    for (start, end), digest, aligned in zip(ranges, digests, line_aligned):
+        if not aligned:
+            break
+        recorded.append((start, end, digest))
+    cache.set_file_chunks(file_name, recorded)
+    cache.save()
+
+    logging.info(
+        f"Counted {len(missing)} of {len(ranges)} chunks, "
+        f"{len(ranges) - len(missing)} served from cache."
+    )
+    return sum(counts)
+
+
+def is_pattern(path):
+    "Returns True if path contains glob wildcards"
+    return any(c in path for c in "*?[")
+
+
+def find_files(pattern):
+    """Yields files matching glob pattern (recursive with '**'), or all
+    files below given directory, or just the given file"""
+
+    if os.path.isdir(pattern):
+        for root, dirs, files in os.walk(pattern):
+            dirs.sort()
+            for name in sorted(files):
+                yield os.path.join(root, name)
+    elif is_pattern(pattern):
+        for path in glob.iglob(pattern, recursive=True):
+            if os.path.isfile(path):
+                yield path
+    else:
+        yield pattern
+
+
+def count_words_in_files(file_names, processes=None, pack_size=PACK_SIZE):
+    """Counts words in many files using a bounded pool of worker processes.
+    Files are consumed lazily from given iterable and submitted as they come,
+    with at most a few tasks per worker pending at any time. Small files are
+    packed together into one task, large files are split into chunks.
+    Returns dict with word count per file."""
+
+    processes = processes or os.cpu_count()
+    max_pending = processes * 4
+    counts, pending = {}, set()
+
+    def collect(done):
+        for future in done:
+            for file_name, count in future.result():
+                counts[file_name] += count
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for task in pack_files(file_names, pack_size):
+            for file_name, _, _ in task:
+                counts.setdefault(file_name, 0)
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(pool.submit(count_pack, task))
+        collect(wait(pending).done)
+
+    return counts
+
+
+def pack_files(file_names, pack_size):
+    """Yields tasks, each a list of (file name, start, end) byte ranges.
+    Files smaller than pack_size are packed together until the task reaches
+    pack_size bytes, larger files are split into line-aligned chunks."""
+
+    pack, pack_bytes = [], 0
+    for file_name in file_names:
+        size = os.path.getsize(file_name)
+        if size < pack_size:
+            pack.append((file_name, 0, size))
+            pack_bytes += size
+            if pack_bytes >= pack_size:
+                yield pack
+                pack, pack_bytes = [], 0
+            continue
+
+        with open(file_name, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                ranges = split_ranges(mm, 0, size, pack_size)
+        for start, end in ranges:
+            yield [(file_name, start, end)]
+
+    if pack:
+        yield pack
+
+
+def count_pack(task):
+    "Counts words of all byte ranges in task. Worker function."
+
+    return [
+        (file_name, count_range(file_name, start, end) if end > start else 0)
+        for file_name, start, end in task
+    ]
+
+
+def map_ranges(pool, fn, file_name, ranges):
+    """Applies worker function to all byte ranges of file, in given
+    process pool or in current process if pool is None"""
+
+    mapper = pool.map if pool else map
+    return list(
+        mapper(
+            fn,
+            [file_name] * len(ranges),
+            [start for start, _ in ranges],
+            [end for _, end in ranges],
+        )
+    )
+
+
+def default_chunk_size(size, processes):
+    """Returns chunk size giving each worker a few chunks for load
+    balancing, while keeping per-chunk overhead small"""
+
+    return min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, size // (processes * 4) + 1))
+
+
+def split_ranges(mm, start, end, chunk_size):
+    """Splits [start, end) into ranges of roughly chunk_size bytes.
+    Every range except possibly the last one ends right after a newline."""
+
+    ranges = []
+    while start < end:
+        stop = start + chunk_size
+        if stop >= end:
+            stop = end
+        else:
+            newline = mm.find(b"\n", stop - 1, end)
+            stop = end if newline == -1 else newline + 1
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def hash_range(file_name, start, end):
+    "Returns content hash of byte range of file. Worker function."
+
+    digest = hashlib.sha1()
+    with open(file_name, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for pos in range(start, end, BLOCK_SIZE):
+                digest.update(mm[pos : min(pos + BLOCK_SIZE, end)])
+    return digest.hexdigest()
+
+
+def count_range(file_name, start, end):
+    """Counts words in byte range of file. Worker function, executed in
+    separate process. Decodes in blocks to keep memory usage flat and
+    corrects for words spanning two blocks."""
+
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    count, in_word = 0, False
+
+    with open(file_name, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for pos in range(start, end, BLOCK_SIZE):
+                text = decoder.decode(
+                    mm[pos : min(pos + BLOCK_SIZE, end)], final=pos + BLOCK_SIZE >= end
+                )
+                if not text:
+                    continue
+                count += len(text.split())
+                if in_word and not text[0].isspace():
+                    count -= 1  # word continued from previous block
+                in_word = not text[-1].isspace()
+
+    return count
@@ -1,5 +1,9 @@
+import itertools
 import logging
-from freyja import Automation, Step, Input, Output
+import os
+from freyja import Automation, Step, Input, Output, List, Optional
+from cache import ChunkCache
+from parallel import count_words, count_words_in_files, find_files, is_pattern
 
 
 class WordCounter(Step):
@@ -10,17 +14,147 @@ class WordCounter(Step):
         self.count = len(self.line.strip().split())
 
 
-class Main(Step):
+class BatchWordCounter(Step):
+    "Counts words in a block of lines and returns the partial count"
+
+    lines = Input(List[str])
+    count = Output(int)
+
+    def execute(self):
+        self.count = sum(len(line.split()) for line in self.lines)
+
+
+class SumCounts(Step):
+    "Reduces partial counts into a total"
+
+    counts = Input(List[int])
+    total = Output(int)
+
+    def execute(self):
+        self.total = sum(self.counts)
+
+
+class ParallelWordCounter(Step):
+    """Counts words of a memory-mapped file in a pool of worker processes.
+    Intended for multi-GB files where one step per line or block would
+    be too costly."""
+
     file_name = Input(str)
+    processes = Input(Optional[int])
+    cache_dir = Input(Optional[str])
+    count = Output(int)
 
     def execute(self):
+        cache = ChunkCache(str(self.cache_dir)) if self.cache_dir else None
+        self.count = count_words(
+            str(self.file_name), processes=self.processes, cache=cache
+        )
+
+
+class MultiFileWordCounter(Step):
+    """Counts words in all files matching a glob pattern or below a
+    directory, using a bounded pool of worker processes. Reports word
+    count per file and in total."""
+
+    pattern = Input(str)
+    processes = Input(Optional[int])
+    count = Output(int)
+
+    def execute(self):
+        counts = count_words_in_files(
+            find_files(str(self.pattern)), processes=self.processes
+        )
+        for file_name, count in sorted(counts.items()):
+            logging.info(f"{file_name}: {count} words")
+        logging.info(f"Found {sum(counts.values())} words in {len(counts)} files.")
+
+        self.count = sum(counts.values())
+
+
+class Main(Step):
+    file_name = Input(
+        str,
+        name="File name",
+        description="Text file to count words in. Can also be a directory "
+        "or glob pattern to count words across many files.",
+    )
+    batch_lines = Input(
+        Optional[int],
+        name="Lines per batch",
+        description="Count blocks of this many lines per step instead of "
+        "one step per line.",
+    )
+    batch_bytes = Input(
+        Optional[int],
+        name="Bytes per batch",
+        description="Count blocks of roughly this many bytes (whole lines) "
+        "per step instead of one step per line.",
+    )
+    processes = Input(
+        Optional[int],
+        name="Worker processes",
+        description="Count memory-mapped file in this many worker processes "
+        "instead of using one step per line or block.",
+    )
+    cache_dir = Input(
+        Optional[str],
+        name="Cache directory",
+        description="Count incrementally, re-using word counts of unchanged "
+        "chunks cached in this directory during earlier runs.",
+    )
+
+    count = Output(int)
+
+    def execute(self):
+        file_name = str(self.file_name)
+        if os.path.isdir(file_name) or is_pattern(file_name):
+            count = MultiFileWordCounter(
+                pattern=self.file_name, processes=self.processes
+            ).count
+        elif self.processes or self.cache_dir:
+            count = ParallelWordCounter(
+                file_name=self.file_name,
+                processes=self.processes,
+                cache_dir=self.cache_dir,
+            ).count
+        elif self.batch_lines or self.batch_bytes:
+            count = self.count_batched()
+        else:
+            with open(str(self.file_name), "r") as f:
+                counts = [
+                    WordCounter(f"counter{idx}", line=line).count
+                    for idx, line in enumerate(f)
+                ]
+            count = sum(counts)
+
+        logging.info(f"Found {count} words.")
+        self.count = count
+
+    def count_batched(self):
+        """Creates one step per block of lines and sums partial counts
+        in a reduce step, so the number of graph nodes grows with the
+        number of blocks rather than the number of lines."""
+
         with open(str(self.file_name), "r") as f:
             counts = [
-                WordCounter(f"counter{idx}", line=line).count
-                for idx, line in enumerate(f)
+                BatchWordCounter(f"counter{idx}", lines=lines).count
+                for idx, lines in enumerate(self.read_batches(f))
             ]
 
-        logging.info(f"Found {sum(counts)} words.")
+        return SumCounts(counts=counts).total
+
+    def read_batches(self, f):
+        "Yields lists of lines, either by line count or by size in bytes"
+
+        if self.batch_lines:
+            while True:
+                lines = list(itertools.islice(f, self.batch_lines))
+                if not lines:
+                    return
+                yield lines
+        else:
+            # readlines() with a size hint returns whole lines only
+            yield from iter(lambda: f.readlines(self.batch_bytes), [])
 
 
 if __name__ == "__main__":